@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BikesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "bikes"
+
+    def ready(self):
+        import bikes.signals  # noqa: F401
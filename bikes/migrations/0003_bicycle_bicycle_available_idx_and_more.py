@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:00
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bikes", "0002_rename_rented_bicycle_is_rented"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="bicycle",
+            index=models.Index(
+                condition=models.Q(("is_rented", False)),
+                fields=["type", "condition"],
+                name="bicycle_available_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bicycle",
+            index=models.Index(fields=["brand"], name="bicycle_brand_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="bicycle",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("brand"), name="gin_trgm_ops"
+                ),
+                name="bicycle_brand_trgm_idx",
+            ),
+        ),
+    ]
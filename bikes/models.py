@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 
 
 class Bicycle(models.Model):
@@ -41,3 +43,17 @@ class Bicycle(models.Model):
     class Meta:
         verbose_name = "bicycle"
         verbose_name_plural = "bicycles"
+        indexes = [
+            # Только доступные велосипеды, с фильтрами по типу и состоянию
+            models.Index(
+                fields=["type", "condition"],
+                condition=models.Q(is_rented=False),
+                name="bicycle_available_idx",
+            ),
+            models.Index(fields=["brand"], name="bicycle_brand_idx"),
+            # Триграммный индекс для фильтра brand__icontains (UPPER(brand) LIKE UPPER(...))
+            GinIndex(
+                OpClass(Upper("brand"), name="gin_trgm_ops"),
+                name="bicycle_brand_trgm_idx",
+            ),
+        ]
@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from bikes.models import Bicycle
+from config.replicas import primary_reads
+from config.sparse_fields import FIELDS_PARAM
+
+logger = logging.getLogger(__name__)
+
+# Ответы кэшируются под ключом с версией данных: список велосипедов и доступные велосипеды -
+# с общей версией списков, один велосипед - с версией этого велосипеда. Изменение велосипеда
+# увеличивает версии, и следующие запросы читают новые ключи, старые записи истекают сами.
+# Версия велосипеда создаётся только для велосипеда из бд и хранится BIKE_VERSION_TIMEOUT секунд.
+RESPONSE_KEY_PREFIX = "bikes:response"
+VERSION_KEY_PREFIX = "bikes:version"
+LIST_VERSION_KEY = f"{VERSION_KEY_PREFIX}:list"
+BIKE_VERSION_TIMEOUT = 60 * 60 * 24
+# Запись свежая RESPONSE_TIMEOUT секунд, затем ещё STALE_TIMEOUT секунд отдаётся, пока один
+# из запросов строит новую
+RESPONSE_TIMEOUT = 60 * 5
+STALE_TIMEOUT = 30
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+# Атрибуты классов пагинации DRF с именами параметров запроса
+PAGINATION_PARAM_ATTRS = (
+    "page_query_param", "page_size_query_param", "limit_query_param", "offset_query_param", "cursor_query_param",
+)
+HITS_KEY = f"{RESPONSE_KEY_PREFIX}:hits"
+MISSES_KEY = f"{RESPONSE_KEY_PREFIX}:misses"
+
+
+def _bike_version_key(bike_id):
+    return f"{VERSION_KEY_PREFIX}:{bike_id}"
+
+
+def _count(key):
+    """Увеличивает счётчик попаданий или промахов кэша ответов."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def _bump(key, timeout=None):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Начальная версия - текущее время, чтобы версия, вытесненная из кэша или истёкшая,
+        # не совпала с версией ещё хранящихся ответов
+        cache.add(key, time.time_ns(), timeout)
+
+
+def get_version(bike_id=None):
+    """
+    Возвращает версию списков велосипедов или версию велосипеда bike_id.
+
+    Отсутствующая версия велосипеда создаётся, только если велосипед есть в бд, иначе
+    возвращается None: запросы к несуществующим id не создают записей в кэше.
+    """
+    if bike_id is None:
+        key, timeout = LIST_VERSION_KEY, None
+    else:
+        key, timeout = _bike_version_key(bike_id), BIKE_VERSION_TIMEOUT
+
+    version = cache.get(key)
+    if version is None:
+        if bike_id is not None:
+            with primary_reads():
+                if not Bicycle.objects.filter(pk=bike_id).exists():
+                    return None
+        cache.add(key, time.time_ns(), timeout)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_bike_responses(bike_id=None):
+    """
+    Сбрасывает закэшированные ответы со списками велосипедов и ответ с велосипедом bike_id.
+
+    Вызывается после фиксации транзакции, изменившей велосипед, и после обновления индекса
+    доступных велосипедов.
+    """
+    _bump(LIST_VERSION_KEY)
+    if bike_id is not None:
+        _bump(_bike_version_key(bike_id), BIKE_VERSION_TIMEOUT)
+
+
+def view_query_params(view):
+    """
+    Параметры запроса, от которых зависит ответ представления: выборочные поля,
+    фильтры filterset_class и параметры пагинации.
+    """
+    params = {FIELDS_PARAM}
+    filterset_class = getattr(view, "filterset_class", None)
+    if filterset_class is not None:
+        params.update(filterset_class.base_filters)
+    paginator = getattr(view, "paginator", None)
+    for attr in PAGINATION_PARAM_ATTRS:
+        if getattr(paginator, attr, None):
+            params.add(getattr(paginator, attr))
+    return params
+
+
+def response_cache_key(scope, request, version, params):
+    """
+    Ключ ответа: представление, версия данных и параметры запроса из params.
+
+    Остальные параметры на ответ не влияют и в ключ не входят, иначе произвольные параметры
+    создавали бы новые записи в обход кэша. Параметры сортируются, чтобы их порядок в адресе
+    не создавал разные записи. Адрес сервера входит в ключ, так как ссылки на изображения
+    в ответе абсолютные.
+    """
+    params = urlencode(sorted(
+        (key, value) for key, values in request.query_params.lists() if key in params for value in values
+    ))
+    digest = hashlib.md5(f"{request.scheme}://{request.get_host()}?{params}".encode()).hexdigest()
+    return f"{RESPONSE_KEY_PREFIX}:{scope}:{version}:{digest}"
+
+
+def get_or_build_response(key, build):
+    """
+    Возвращает данные ответа из кэша или строит их функцией build и сохраняет в кэш.
+
+    Защита от одновременного перестроения популярного ключа: данные строит только запрос,
+    получивший блокировку. Остальные в это время отдают устаревшую запись, а если её нет -
+    ждут новую до LOCK_WAIT секунд, после чего строят данные сами без сохранения в кэш.
+    Исключения build (ошибки валидации, 404) не кэшируются. Данные читаются из основной бд.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry["fresh_until"] > time.time():
+        _count(HITS_KEY)
+        return entry["data"]
+
+    _count(MISSES_KEY)
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            with primary_reads():
+                data = build()
+            entry = {"data": data, "fresh_until": time.time() + RESPONSE_TIMEOUT}
+            cache.set(key, entry, RESPONSE_TIMEOUT + STALE_TIMEOUT)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        return entry["data"]
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["data"]
+    logger.warning(f"Response cache lock timeout for {key}, response is built without cache.")
+    with primary_reads():
+        return build()
+
+
+def cached_response(request, scope, build, params, bike_id=None):
+    """
+    Ответ представления из кэша ответов с поддержкой условных запросов.
+
+    ETag вычисляется по версии данных без запросов к бд: если версия не изменилась
+    с предыдущего ответа клиенту (If-None-Match), возвращается 304 без тела, данные
+    не читаются и не сериализуются. Last-Modified не отправляется: с точностью до секунды
+    он не отличает версии, изменённые в течение одной секунды, и If-Modified-Since
+    получал бы 304 для устаревших данных.
+    """
+    version = get_version(bike_id)
+    if version is None:
+        # Велосипеда нет в бд: build отвечает 404, ответ не кэшируется
+        return Response(build())
+    etag = quote_etag(f"{scope}-{version}-{request.accepted_renderer.format}")
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        key = response_cache_key(scope, request, version, params)
+        response = Response(get_or_build_response(key, build))
+    response["ETag"] = etag
+    # Ответ зависит от пользователя (права доступа), клиент проверяет актуальность при каждом запросе
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_response_cache_stats():
+    """Возвращает количество попаданий и промахов кэша ответов."""
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": stats.get(HITS_KEY, 0), "misses": stats.get(MISSES_KEY, 0)}
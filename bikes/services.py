@@ -0,0 +1,214 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import product
+
+from django.core.cache import cache
+
+from bikes.models import Bicycle
+from bikes.response_cache import invalidate_bike_responses
+from bikes.serializers import serialize_bikes
+from config.replicas import primary_reads
+
+logger = logging.getLogger(__name__)
+
+# Индекс доступных велосипедов хранится в кэше записями двух видов:
+# - состав каждой пары (тип, состояние): отсортированный список id всех велосипедов пары,
+#   меняется только при изменении каталога, после чего пары перестраиваются;
+# - данные каждого велосипеда (вместе с is_rented) отдельной записью: аренда и возврат
+#   перезаписывают только запись своего велосипеда.
+# Ключи содержат поколение индекса: полный сброс увеличивает его, старые записи истекают сами.
+INDEX_KEY_PREFIX = "bikes:available"
+GENERATION_KEY = f"{INDEX_KEY_PREFIX}:generation"
+INDEX_TIMEOUT = 60 * 5
+BIKE_TIMEOUT = 60 * 60 * 24
+REBUILD_LOCK_KEY = f"{INDEX_KEY_PREFIX}:lock"
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+HITS_KEY = f"{INDEX_KEY_PREFIX}:hits"
+MISSES_KEY = f"{INDEX_KEY_PREFIX}:misses"
+
+BUCKETS = list(product(
+    [code for code, _ in Bicycle.TYPE_CHOICES],
+    [code for code, _ in Bicycle.CONDITION_CHOICES],
+))
+
+
+def _get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _bucket_key(generation, bike_type, condition):
+    return f"{INDEX_KEY_PREFIX}:{generation}:{bike_type}:{condition}"
+
+
+def _bike_key(generation, bike_id):
+    return f"{INDEX_KEY_PREFIX}:{generation}:bike:{bike_id}"
+
+
+@contextmanager
+def _lock(key):
+    """
+    Блокировка, общая для всех процессов с одним кэшем.
+
+    Снимается, только если всё ещё принадлежит получившему её процессу: после истечения
+    LOCK_TIMEOUT блокировку мог получить другой процесс.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    acquired = cache.add(key, token, LOCK_TIMEOUT)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.01)
+        acquired = cache.add(key, token, LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def _count(key):
+    """Увеличивает счётчик попаданий или промахов индекса."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def _build_index(generation):
+    """Строит состав пар и данные всех велосипедов одним запросом к основной бд."""
+    buckets = {_bucket_key(generation, *bucket): [] for bucket in BUCKETS}
+    with primary_reads():
+        bikes = serialize_bikes(Bicycle.objects.order_by("id"))
+    for bike in bikes:
+        buckets.setdefault(_bucket_key(generation, bike["type"], bike["condition"]), []).append(bike["id"])
+    return buckets, {_bike_key(generation, bike["id"]): bike for bike in bikes}
+
+
+def _add_bikes(entries):
+    """
+    Сохраняет данные велосипедов, которых ещё нет в кэше.
+
+    Записи, уже обновлённые арендой или возвратом после чтения данных из бд, не перезаписываются.
+    """
+    existing = cache.get_many(list(entries))
+    for key, bike in entries.items():
+        if key not in existing:
+            cache.add(key, bike, BIKE_TIMEOUT)
+
+
+def get_available_bikes(bike_type=None, condition=None, brand=None, brand_contains=None):
+    """
+    Возвращает данные доступных велосипедов из индекса в кэше, отсортированные по id.
+
+    При отсутствии состава пар он перестраивается под блокировкой, чтобы параллельные запросы
+    не читали бд одновременно. Если блокировку получить не удалось, данные читаются из бд
+    без сохранения в кэш. Данные велосипедов, вытесненные из кэша, загружаются из бд.
+    """
+    generation = _get_generation()
+    keys = [
+        _bucket_key(generation, *bucket) for bucket in BUCKETS
+        if bike_type in (None, bucket[0]) and condition in (None, bucket[1])
+    ]
+    buckets = cache.get_many(keys)
+    entries = None
+
+    if len(buckets) == len(keys):
+        _count(HITS_KEY)
+    else:
+        _count(MISSES_KEY)
+        with _lock(REBUILD_LOCK_KEY) as locked:
+            buckets = cache.get_many(keys)
+            if len(buckets) < len(keys):
+                index, entries = _build_index(generation)
+                if locked:
+                    _add_bikes(entries)
+                    cache.set_many(index, INDEX_TIMEOUT)
+                buckets = {key: index.get(key, []) for key in keys}
+
+    bike_keys = {_bike_key(generation, bike_id): bike_id for bucket in buckets.values() for bike_id in bucket}
+    if entries is None:
+        entries = cache.get_many(list(bike_keys))
+        missing = [bike_id for key, bike_id in bike_keys.items() if key not in entries]
+        if missing:
+            with primary_reads():
+                loaded = {_bike_key(generation, bike["id"]): bike
+                          for bike in serialize_bikes(Bicycle.objects.filter(pk__in=missing))}
+            _add_bikes(loaded)
+            entries.update(loaded)
+
+    bikes = [entries[key] for key in bike_keys if key in entries]
+    bikes = [
+        bike for bike in bikes
+        if not bike["is_rented"] and bike_type in (None, bike["type"]) and condition in (None, bike["condition"])
+    ]
+
+    if brand:
+        bikes = [bike for bike in bikes if bike["brand"] == brand]
+    if brand_contains:
+        brand_contains = brand_contains.upper()
+        bikes = [bike for bike in bikes if brand_contains in bike["brand"].upper()]
+
+    bikes.sort(key=lambda bike: bike["id"])
+    return bikes
+
+
+def refresh_bike_availability(bike_id):
+    """
+    Обновляет запись велосипеда в индексе после аренды или возврата.
+
+    Состояние велосипеда перечитывается из бд под блокировкой этого велосипеда, поэтому
+    при параллельных арендах и возвратах последним в индекс попадает актуальное состояние,
+    а аренды разных велосипедов не ждут друг друга. Вызывается после фиксации транзакции.
+    """
+    try:
+        _refresh_bike(bike_id)
+    finally:
+        # Кэш ответов сбрасывается после обновления индекса, ответы для новой версии
+        # строятся уже из обновлённого индекса
+        invalidate_bike_responses(bike_id)
+
+
+def _refresh_bike(bike_id):
+    key = _bike_key(_get_generation(), bike_id)
+    with _lock(f"{key}:lock") as locked:
+        if not locked:
+            logger.warning(f"Availability index lock timeout, index entry for bike {bike_id} is invalidated.")
+            cache.delete(key)
+            return
+
+        with primary_reads():
+            bike = next(iter(serialize_bikes(Bicycle.objects.filter(pk=bike_id))), None)
+        if bike is None:
+            cache.delete(key)
+        else:
+            cache.set(key, bike, BIKE_TIMEOUT)
+
+
+def invalidate_availability_index(bike_id=None):
+    """
+    Сбрасывает индекс доступных велосипедов, он будет перестроен при следующем запросе.
+
+    При изменении велосипеда bike_id сбрасываются состав пар и запись этого велосипеда,
+    без bike_id (массовое изменение каталога) - весь индекс.
+    """
+    if bike_id is None:
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, time.time_ns(), None)
+        return
+
+    generation = _get_generation()
+    cache.delete_many([_bucket_key(generation, *bucket) for bucket in BUCKETS] + [_bike_key(generation, bike_id)])
+
+
+def get_availability_index_stats():
+    """Возвращает количество попаданий и промахов индекса доступных велосипедов."""
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": stats.get(HITS_KEY, 0), "misses": stats.get(MISSES_KEY, 0)}
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bikes.models import Bicycle
+from bikes.response_cache import invalidate_bike_responses
+from bikes.services import invalidate_availability_index
+
+
+@receiver(post_save, sender=Bicycle)
+@receiver(post_delete, sender=Bicycle)
+def bike_changed(sender, instance, update_fields=None, **kwargs):
+    """
+    Сбрасывает индекс доступных велосипедов и кэш ответов при изменении каталога.
+
+    Аренда и возврат меняют только поле is_rented и обновляют индекс и кэш ответов сами.
+    """
+    if update_fields is not None and set(update_fields) == {"is_rented"}:
+        return
+    bike_id = instance.pk
+
+    def invalidate():
+        # Версии ответов увеличиваются после сброса индекса, иначе новый ответ
+        # может быть построен из старого индекса
+        invalidate_availability_index(bike_id)
+        invalidate_bike_responses(bike_id)
+
+    transaction.on_commit(invalidate)
@@ -1,11 +1,28 @@
+import gzip
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from io import BytesIO
+
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.translation import gettext_lazy
 from model_bakery import baker
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
 
 from bikes.models import Bicycle
+from bikes.response_cache import VERSION_KEY_PREFIX, get_or_build_response, get_response_cache_stats
+from bikes.serializers import BikeSerializer, serialize_bikes
+from bikes.services import _lock, get_availability_index_stats, refresh_bike_availability
+from config.compression import COMPRESSORS, choose_encoding, get_compression_stats
+from config.renderers import ORJSONParser, ORJSONRenderer
+from rents.models import Rental
 from users.models import User
 
 
@@ -24,6 +41,7 @@ class BikeTestCase(TestCase):
         Создает клиент API, пользователя-модератора и несколько велосипедов для использования в тестах.
         """
         self.client = APIClient()
+        cache.clear()
 
         # Создаем модератора, т.к. он может управлять данными
         self.moder = baker.make(User, is_staff=True)
@@ -94,6 +112,390 @@ class BikeTestCase(TestCase):
         self.assertEqual(len(response.data), 2)  # Только неарендованный велосипед
 
 
+class AvailableBikesIndexTestCase(TestCase):
+    """Тестовый класс для индекса доступных велосипедов в кэше."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = baker.make(User)
+        self.client.force_authenticate(user=self.user)
+
+        self.bike1 = baker.make(Bicycle, brand="Stels", type="A", condition="E")
+        self.bike2 = baker.make(Bicycle, brand="Forward", type="K", condition="G")
+        self.bike3 = baker.make(Bicycle, brand="Stern", type="A", condition="G", is_rented=True)
+        self.url = reverse("bikes:available-bikes")
+
+    def test_served_from_cache(self):
+        """Тестирование чтения списка из кэша без запросов к бд."""
+
+        response = self.client.get(self.url)
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk, self.bike2.pk])
+
+        # Другие параметры: ответа в кэше нет, список строится из индекса
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"condition": "G"})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(get_availability_index_stats(), {"hits": 1, "misses": 1})
+
+    def test_filters(self):
+        """Тестирование фильтрации списка из кэша."""
+
+        response = self.client.get(self.url, {"type": "A"})
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk])
+
+        response = self.client.get(self.url, {"brand__icontains": "st"})
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk])
+
+        response = self.client.get(self.url, {"brand": "Forward", "condition": "G"})
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike2.pk])
+
+        response = self.client.get(self.url, {"type": "X"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_rent_and_return_update_index(self):
+        """Тестирование обновления индекса при аренде и возврате велосипеда."""
+
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("rents:rent-bike", kwargs={"bike_id": self.bike1.pk}))
+        response = self.client.get(self.url)
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike2.pk])
+
+        rental = Rental.objects.get(rented_bike=self.bike1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse("rents:return-bike", kwargs={"pk": rental.pk}))
+        response = self.client.get(self.url)
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk, self.bike2.pk])
+        self.assertEqual(get_availability_index_stats()["misses"], 1)
+
+    def test_refresh_updates_only_bike_entry(self):
+        """Тестирование обновления записи одного велосипеда без перестроения индекса."""
+
+        self.client.get(self.url)
+        Bicycle.objects.filter(pk=self.bike1.pk).update(is_rented=True)
+
+        # Перечитывается только изменённый велосипед
+        with self.assertNumQueries(1):
+            refresh_bike_availability(self.bike1.pk)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike2.pk])
+        self.assertEqual(get_availability_index_stats(), {"hits": 1, "misses": 1})
+
+    def test_lock_released_only_by_owner(self):
+        """Тестирование снятия блокировки только получившим её процессом."""
+
+        with _lock("test:lock") as locked:
+            self.assertTrue(locked)
+            # Блокировка истекла и получена другим процессом
+            cache.set("test:lock", "other")
+        self.assertEqual(cache.get("test:lock"), "other")
+
+        cache.delete("test:lock")
+        with _lock("test:lock") as locked:
+            self.assertTrue(locked)
+        self.assertIsNone(cache.get("test:lock"))
+
+
+class ResponseCacheTestCase(TestCase):
+    """Тестовый класс для кэша ответов списка и велосипеда."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.moder = baker.make(User, is_staff=True)
+        moderator_group, _ = Group.objects.get_or_create(name="moderators")
+        self.moder.groups.add(moderator_group)
+        self.client.force_authenticate(user=self.moder)
+
+        self.bike1 = baker.make(Bicycle, brand="Stels", type="A", condition="E")
+        self.bike2 = baker.make(Bicycle, brand="Forward", type="K", condition="G")
+        self.list_url = reverse("bikes:bicycles-list")
+        self.detail_url = reverse("bikes:bicycles-detail", kwargs={"pk": self.bike1.pk})
+
+    def test_list_and_detail_served_from_cache(self):
+        """Тестирование повторных запросов без обращения к бд, порядок параметров не важен."""
+
+        available_url = reverse("bikes:available-bikes")
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        self.client.get(available_url, {"type": "A", "condition": "E"})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(self.list_url).data), 2)
+            self.assertEqual(self.client.get(self.detail_url).data["brand"], "Stels")
+            response = self.client.get(f"{available_url}?condition=E&type=A")
+            self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk])
+        self.assertEqual(get_response_cache_stats(), {"hits": 3, "misses": 3})
+
+    def test_unused_params_share_cache_entry(self):
+        """Тестирование ключа кэша: параметры, не влияющие на ответ, не создают новых записей."""
+
+        available_url = reverse("bikes:available-bikes")
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        self.client.get(available_url, {"type": "A"})
+
+        with self.assertNumQueries(0):
+            self.client.get(self.list_url, {"junk": "1"})
+            self.client.get(self.detail_url, {"junk": "2"})
+            self.client.get(self.detail_url, {"junk": "3"})
+            response = self.client.get(available_url, {"type": "A", "_": "12345"})
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike1.pk])
+        self.assertEqual(get_response_cache_stats(), {"hits": 4, "misses": 3})
+
+        # Параметры, влияющие на ответ, входят в ключ
+        response = self.client.get(self.list_url, {"fields": "id"})
+        self.assertEqual(response.data[0], {"id": self.bike1.pk})
+
+    def test_update_invalidates(self):
+        """Тестирование сброса кэша при изменении велосипеда."""
+
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        self.client.get(reverse("bikes:available-bikes"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.detail_url, {"brand": "Better Brand"})
+
+        self.assertEqual(self.client.get(self.detail_url).data["brand"], "Better Brand")
+        brands = [bike["brand"] for bike in self.client.get(self.list_url).data]
+        self.assertIn("Better Brand", brands)
+        brands = [bike["brand"] for bike in self.client.get(reverse("bikes:available-bikes")).data]
+        self.assertIn("Better Brand", brands)
+
+    def test_rent_invalidates(self):
+        """Тестирование сброса кэша при аренде велосипеда."""
+
+        self.client.get(self.detail_url)
+        self.client.get(reverse("bikes:available-bikes"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("rents:rent-bike", kwargs={"bike_id": self.bike1.pk}))
+
+        self.assertTrue(self.client.get(self.detail_url).data["is_rented"])
+        response = self.client.get(reverse("bikes:available-bikes"))
+        self.assertEqual([bike["id"] for bike in response.data], [self.bike2.pk])
+
+    def test_stale_response_while_rebuilding(self):
+        """Тестирование защиты от одновременного перестроения: пока ключ перестраивается, отдаётся старая запись."""
+
+        key = "bikes:response:list:1:test"
+        cache.set(key, {"data": ["stale"], "fresh_until": 0})
+        cache.add(f"{key}:lock", 1)
+
+        def build():
+            raise AssertionError("Response is rebuilt by a concurrent request.")
+
+        self.assertEqual(get_or_build_response(key, build), ["stale"])
+
+        cache.delete(f"{key}:lock")
+        self.assertEqual(get_or_build_response(key, lambda: ["fresh"]), ["fresh"])
+        self.assertEqual(get_or_build_response(key, build), ["fresh"])
+
+
+class ConditionalRequestTestCase(TestCase):
+    """Тестовый класс для условных запросов (ETag) к каталогу велосипедов."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = baker.make(User)
+        self.client.force_authenticate(user=self.user)
+        self.bike = baker.make(Bicycle, brand="Stels")
+        self.urls = [
+            reverse("bikes:bicycles-list"),
+            reverse("bikes:bicycles-detail", kwargs={"pk": self.bike.pk}),
+            reverse("bikes:available-bikes"),
+        ]
+
+    def test_not_modified(self):
+        """Тестирование ответа 304 без чтения данных, если каталог не изменился."""
+
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertIn("ETag", response)
+            self.assertNotIn("Last-Modified", response)
+
+            with self.assertNumQueries(0):
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified["ETag"], response["ETag"])
+
+            # Без версии данных If-Modified-Since не даёт 304
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_response_cache_stats()["misses"], 3)
+
+    def test_missing_bike_creates_no_version(self):
+        """Тестирование: запрос несуществующего велосипеда не создаёт записей в кэше."""
+
+        url = reverse("bikes:bicycles-detail", kwargs={"pk": self.bike.pk + 1000})
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(cache.get(f"{VERSION_KEY_PREFIX}:{self.bike.pk + 1000}"))
+        self.assertEqual(get_response_cache_stats(), {"hits": 0, "misses": 0})
+
+    def test_modified_after_bike_change(self):
+        """Тестирование нового ETag после изменения велосипеда."""
+
+        etags = [self.client.get(url)["ETag"] for url in self.urls]
+
+        self.bike.brand = "Forward"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bike.save()
+
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+
+
+class SerializeBikesTestCase(TestCase):
+    """Тестовый класс для быстрой сериализации списка велосипедов."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_same_output_as_serializer(self):
+        """Тестирование совпадения JSON с результатом BikeSerializer, со ссылками на изображения и без них."""
+
+        baker.make(Bicycle, image="bicycles/stels.jpg", colour="Красный", rental_cost_hour=Decimal("5.5"))
+        baker.make(Bicycle, image="", colour=None, is_rented=True)
+        baker.make(Bicycle, image=None)
+        request = APIRequestFactory().get("/")
+        queryset = Bicycle.objects.order_by("id")
+
+        for context in ({}, {"request": request}):
+            expected = JSONRenderer().render(BikeSerializer(queryset, many=True, context=context).data)
+            self.assertEqual(JSONRenderer().render(serialize_bikes(queryset, context.get("request"))), expected)
+
+    def test_list_response(self):
+        """Тестирование ответа списка велосипедов без сериалайзера."""
+
+        baker.make(Bicycle, image="bicycles/stels.jpg", _quantity=2)
+        client = APIClient()
+        client.force_authenticate(user=baker.make(User))
+        response = client.get(reverse("bikes:bicycles-list"))
+        expected = BikeSerializer(Bicycle.objects.all(), many=True, context={"request": response.wsgi_request}).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+        self.assertTrue(response.data[0]["image"].startswith("http://testserver/"))
+
+
+class SparseFieldsTestCase(TestCase):
+    """Тестовый класс для выборочных полей ответа (?fields=)."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=baker.make(User))
+        self.bike = baker.make(Bicycle, type="A", rental_cost_hour=Decimal("5.50"))
+
+    def test_fields(self):
+        """Тестирование ответа и запроса к бд только с запрошенными полями."""
+
+        expected = [{"id": self.bike.pk, "type": "A", "rental_cost_hour": "5.50"}]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("bikes:bicycles-list"), {"fields": "rental_cost_hour,type, id"})
+        self.assertEqual(response.json(), expected)
+        self.assertNotIn("brand", queries[-1]["sql"])
+
+        response = self.client.get(reverse("bikes:available-bikes"), {"fields": "id,type,rental_cost_hour"})
+        self.assertEqual(response.json(), expected)
+
+        response = self.client.get(reverse("bikes:bicycles-detail", kwargs={"pk": self.bike.pk}), {"fields": "id,type"})
+        self.assertEqual(response.json(), {"id": self.bike.pk, "type": "A"})
+
+    def test_unknown_field(self):
+        """Тестирование ошибки при неизвестном поле."""
+
+        response = self.client.get(reverse("bikes:available-bikes"), {"fields": "id,price"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("fields", response.data)
+
+
+class CompressionTestCase(TestCase):
+    """Тестовый класс для сжатия ответов каталога."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=baker.make(User))
+        baker.make(Bicycle, _quantity=20)
+        self.url = reverse("bikes:available-bikes")
+
+    def test_gzip_and_precompressed_body(self):
+        """Тестирование сжатия gzip и повторного использования сжатого тела из кэша."""
+
+        plain = self.client.get(self.url)
+        self.assertNotIn("Content-Encoding", plain)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], f"W/{plain['ETag']}")
+
+        self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        stats = get_compression_stats()["gzip"]
+        self.assertEqual(stats["responses"], 2)
+        self.assertEqual(stats["precompressed_hits"], 1)
+        self.assertEqual(stats["bytes_in"], 2 * len(plain.content))
+        self.assertGreater(stats["bytes_saved"], len(plain.content))
+
+        # Слабый ETag сжатого ответа подходит для условного запроса
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_small_response_not_compressed(self):
+        """Тестирование: ответ меньше порога не сжимается."""
+
+        response = self.client.get(self.url, {"fields": "id"}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_choose_encoding(self):
+        """Тестирование выбора способа сжатия по заголовку Accept-Encoding."""
+
+        self.assertEqual(choose_encoding("deflate, gzip;q=0.5"), "gzip")
+        self.assertIsNone(choose_encoding("gzip;q=0, deflate"))
+        self.assertIsNone(choose_encoding(""))
+        with self.settings(RESPONSE_COMPRESSION_ENCODINGS=["zstd", "gzip"]):
+            self.assertEqual(choose_encoding("*"), "zstd" if "zstd" in COMPRESSORS else "gzip")
+
+
+class ORJSONRendererTestCase(TestCase):
+    """Тестовый класс для JSON-рендерера и парсера на orjson."""
+
+    def test_same_output_as_json_renderer(self):
+        """Тестирование совпадения ответа с ответом стандартного JSONRenderer."""
+
+        bikes = baker.make(Bicycle, _quantity=3, brand="Велосипед\u2028")
+        data = {
+            "bikes": BikeSerializer(bikes, many=True).data,
+            "total": Decimal("10.50"),
+            "created": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            "day": date(2024, 5, 1),
+            "label": gettext_lazy("Велосипеды"),
+            1: None,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"),
+        )
+
+    def test_parser(self):
+        """Тестирование разбора тела запроса и ошибки разбора."""
+
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"brand": "Стелс", "gear_count": 6}'.encode())),
+                         {"brand": "Стелс", "gear_count": 6})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b"{brand"))
+
+
 class BikePermsTestCase(TestCase):
     """
     Тестовый класс для проверки разрешений пользователей BikeViewSet.
@@ -138,3 +540,47 @@ class BikePermsTestCase(TestCase):
             reverse("bikes:bicycles-detail", kwargs={"pk": self.bike1.pk})
         )
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BikeIndexUsageTestCase(TestCase):
+    """
+    Тестовый класс для проверки использования индексов велосипедов.
+
+    Заполняет таблицу велосипедов и проверяет планы запросов (EXPLAIN) для фильтров каталога.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        bikes = [
+            Bicycle(
+                brand=f"Brand {i % 200}", condition="EGS"[i % 3], type="AJK"[i % 3], gear_count=6,
+                frame_type="U", wheel_size=26, rental_cost_hour=1, rental_cost_day=10, is_rented=i % 4 == 0,
+            )
+            for i in range(5000)
+        ]
+        Bicycle.objects.bulk_create(bikes)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE bikes_bicycle")
+
+    def setUp(self):
+        # Исключаем последовательное сканирование, чтобы план не зависел от размера тестовых данных
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_available_bikes_index(self):
+        """Тестирование частичного индекса доступных велосипедов."""
+
+        plan = Bicycle.objects.filter(is_rented=False, type="A", condition="E").explain()
+        self.assertIn("bicycle_available_idx", plan)
+
+    def test_brand_index(self):
+        """Тестирование индекса по бренду."""
+
+        plan = Bicycle.objects.filter(brand="Brand 7").explain()
+        self.assertIn("bicycle_brand_idx", plan)
+
+    def test_brand_icontains_trigram_index(self):
+        """Тестирование триграммного индекса для поиска по части бренда."""
+
+        plan = Bicycle.objects.filter(brand__icontains="and 17").explain()
+        self.assertIn("bicycle_brand_trgm_idx", plan)
@@ -1,15 +1,24 @@
 from django_filters import rest_framework as filters
+from django_filters.utils import translate_validation
 from rest_framework import generics, viewsets
 from rest_framework.permissions import IsAuthenticated
 
 from bikes.filters import BikeFilterSet
 from bikes.models import Bicycle
-from bikes.serializers import BikeSerializer
+from bikes.response_cache import cached_response, view_query_params
+from bikes.serializers import BikeSerializer, serialize_bikes
+from bikes.services import get_available_bikes
+from config.sparse_fields import SparseFieldsMixin
 from users.permissions import IsModerator
 
 
-class BikeViewSet(viewsets.ModelViewSet):
-    """API эндпоинт для управления велосипедами"""
+class BikeViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
+    """
+    API эндпоинт для управления велосипедами.
+
+    Список и отдельный велосипед отдаются из кэша ответов, сбрасываемого при изменении велосипедов,
+    и поддерживают условные запросы (ETag) и выборочные поля (?fields=).
+    """
 
     serializer_class = BikeSerializer
     queryset = Bicycle.objects.all()
@@ -21,11 +30,65 @@ class BikeViewSet(viewsets.ModelViewSet):
             self.permission_classes = (IsAuthenticated, IsModerator)
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        # Список только для чтения строится без сериалайзера, ответ совпадает с ответом ModelViewSet.list
+        return cached_response(
+            request,
+            "list",
+            lambda: serialize_bikes(self.filter_queryset(self.get_queryset()), request, self.get_requested_fields()),
+            view_query_params(self),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            bike_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        return cached_response(
+            request,
+            f"detail:{bike_id}",
+            lambda: super(BikeViewSet, self).retrieve(request, *args, **kwargs).data,
+            view_query_params(self),
+            bike_id=bike_id,
+        )
+
+
+class AvailableBikesView(SparseFieldsMixin, generics.ListAPIView):
+    """
+    API эндпоинт для получения списка доступных для аренды велосипедов.
 
-class AvailableBikesView(generics.ListAPIView):
-    """API эндпоинт для получения списка доступных для аренды велосипедов"""
+    Список отдаётся из индекса доступных велосипедов в кэше, без запросов к бд,
+    готовый ответ для тех же параметров - из кэша ответов. Поддерживает условные запросы
+    и выборочные поля (?fields=).
+    """
 
     serializer_class = BikeSerializer
     queryset = Bicycle.objects.filter(is_rented=False)
     filter_backends = [filters.DjangoFilterBackend]
     filterset_class = BikeFilterSet
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, "available", lambda: self.build_list(request), view_query_params(self))
+
+    def build_list(self, request):
+        # Проверка параметров фильтрации теми же фильтрами, что и при запросе к бд
+        filterset = self.filterset_class(request.query_params, queryset=Bicycle.objects.none(), request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        params = filterset.form.cleaned_data
+
+        bikes = get_available_bikes(
+            bike_type=params.get("type") or None,
+            condition=params.get("condition") or None,
+            brand=params.get("brand") or None,
+            brand_contains=params.get("brand__icontains") or None,
+        )
+        fields = self.get_requested_fields()
+        if fields is not None:
+            bikes = [{name: bike[name] for name in fields} for bike in bikes]
+        # В индексе хранятся относительные ссылки на изображения, как без контекста запроса
+        data = [
+            dict(bike, image=request.build_absolute_uri(bike["image"])) if bike.get("image") else bike
+            for bike in bikes
+        ]
+        return data
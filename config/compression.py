@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+# Сжатие gzip доступно всегда, brotli и zstd - если установлены пакеты Brotli и zstandard
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson", "text/csv"}
+
+# Сжатые тела кэшируемых ответов (с ETag) хранятся в кэше по хэшу несжатого тела
+PRECOMPRESSED_KEY_PREFIX = "compression:body"
+PRECOMPRESSED_TIMEOUT = 60 * 5
+METRICS_KEY_PREFIX = "compression:metrics"
+
+
+def _gzip_stream():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+STREAM_COMPRESSORS = {"gzip": _gzip_stream}
+
+if brotli is not None:
+    def _brotli_stream():
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    STREAM_COMPRESSORS["br"] = _brotli_stream
+
+if zstandard is not None:
+    def _zstd_stream():
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return (
+            lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush,
+        )
+
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    STREAM_COMPRESSORS["zstd"] = _zstd_stream
+
+
+def _incr(key, delta=1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, delta, None)
+
+
+def record_compression(encoding, original_size, compressed_size):
+    prefix = f"{METRICS_KEY_PREFIX}:{encoding}"
+    _incr(f"{prefix}:responses")
+    _incr(f"{prefix}:bytes_in", original_size)
+    _incr(f"{prefix}:bytes_out", compressed_size)
+
+
+def get_compression_stats():
+    """Возвращает по каждому способу сжатия количество ответов, размер до и после сжатия и экономию."""
+    names = ("responses", "bytes_in", "bytes_out", "precompressed_hits")
+    keys = [f"{METRICS_KEY_PREFIX}:{encoding}:{name}" for encoding in COMPRESSORS for name in names]
+    values = cache.get_many(keys)
+
+    stats = {}
+    for encoding in COMPRESSORS:
+        prefix = f"{METRICS_KEY_PREFIX}:{encoding}"
+        bytes_in = values.get(f"{prefix}:bytes_in", 0)
+        bytes_out = values.get(f"{prefix}:bytes_out", 0)
+        stats[encoding] = {
+            "responses": values.get(f"{prefix}:responses", 0),
+            "precompressed_hits": values.get(f"{prefix}:precompressed_hits", 0),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "bytes_saved": bytes_in - bytes_out,
+            "ratio": bytes_out / bytes_in if bytes_in else None,
+        }
+    return stats
+
+
+def choose_encoding(accept_encoding):
+    """Выбирает способ сжатия из принимаемых клиентом (с q > 0) в порядке RESPONSE_COMPRESSION_ENCODINGS."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+
+    for encoding in settings.RESPONSE_COMPRESSION_ENCODINGS:
+        if encoding in COMPRESSORS and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов API (JSON, NDJSON, CSV) способом, который поддерживает клиент: br, zstd или gzip.
+
+    Ответы меньше RESPONSE_COMPRESSION_MIN_SIZE байт не сжимаются. Тела кэшируемых ответов
+    каталога (с ETag) сжимаются один раз: сжатое тело хранится в кэше по хэшу несжатого.
+    Потоковые ответы (выгрузки) сжимаются по частям. Размеры до и после сжатия
+    учитываются в метриках (get_compression_stats).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES or response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(response.streaming_content, encoding)
+            del response["Content-Length"]
+        else:
+            content = response.content
+            compressed = self.compress(content, encoding, cacheable=response.has_header("ETag"))
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+            record_compression(encoding, len(content), len(compressed))
+
+        response["Content-Encoding"] = encoding
+        # Сжатое тело отличается от несжатого побайтно: ETag становится слабым, как в GZipMiddleware
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = f"W/{etag}"
+        return response
+
+    def compress(self, content, encoding, cacheable=False):
+        if not cacheable:
+            return COMPRESSORS[encoding](content)
+
+        key = f"{PRECOMPRESSED_KEY_PREFIX}:{encoding}:{hashlib.md5(content).hexdigest()}"
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = COMPRESSORS[encoding](content)
+            cache.set(key, compressed, PRECOMPRESSED_TIMEOUT)
+        else:
+            _incr(f"{METRICS_KEY_PREFIX}:{encoding}:precompressed_hits")
+        return compressed
+
+    def compress_stream(self, chunks, encoding):
+        write, finish = STREAM_COMPRESSORS[encoding]()
+        original_size = compressed_size = 0
+        for chunk in chunks:
+            original_size += len(chunk)
+            data = write(chunk)
+            compressed_size += len(data)
+            if data:
+                yield data
+        data = finish()
+        compressed_size += len(data)
+        yield data
+        record_compression(encoding, original_size, compressed_size)
@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_DATABASE = "replica"
+
+_use_replica = ContextVar("use_replica", default=False)
+
+
+def primary_cache_key(user_id):
+    return f"db:primary:{user_id}"
+
+
+def replica_is_configured():
+    return REPLICA_DATABASE in settings.DATABASES
+
+
+@contextmanager
+def replica_reads():
+    """Чтение из реплики внутри блока (если реплика настроена)."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение из основной бд внутри блока, в том числе в представлении с ReplicaReadMixin.
+
+    Данные, которые сохраняются в общий кэш, читаются из основной бд: отставшая реплика
+    записала бы в кэш устаревшие данные для всех пользователей.
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def pin_to_primary(user_id):
+    """После записи пользователь читает из основной бд, пока реплика не догонит её."""
+    cache.set(primary_cache_key(user_id), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and bool(cache.get(primary_cache_key(user.pk)))
+
+
+class ReplicaRouter:
+    """
+    Роутер бд: чтение из реплики только в представлениях с ReplicaReadMixin, всё остальное - в основной бд.
+
+    Запись, миграции и чтение вне представлений (задачи Celery, команды) всегда идут в основную бд,
+    как и чтение внутри открытой транзакции основной бд: реплика не видит её незафиксированных изменений.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _use_replica.get()
+            and replica_is_configured()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DATABASE
+
+
+class ReplicaReadMixin:
+    """
+    Представление читает из реплики для безопасных методов (GET, HEAD, OPTIONS).
+
+    Пользователь, недавно изменявший данные, читает из основной бд, чтобы видеть свои изменения.
+    Аутентификация и проверка прав выполняются до переключения на реплику.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _use_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned_to_primary(request.user):
+            _use_replica.set(True)
+
+
+class PrimaryStickinessMiddleware:
+    """Закрепляет пользователя за основной бд после успешного изменяющего запроса."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, "user", None)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+            and replica_is_configured()
+        ):
+            pin_to_primary(user.pk)
+        return response
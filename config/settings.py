@@ -28,12 +28,23 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Режим отладки включается явно (True, 1, yes, on), пустое или не заданное значение - выключен
+DEBUG = os.getenv("DEBUG", "").strip().lower() in ("true", "1", "yes", "on")
 
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS").split(",")
 
 # Stripe keys
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Клиент Stripe: адрес API (например, локальный stripe-mock), таймауты в секундах,
+# количество повторов сетевых ошибок и размер пула соединений
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT') or 3)
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT') or 10)
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES') or 2)
+STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE') or 10)
+# Локальная замена Stripe API (users.stripe_fake) для разработки и тестов без сети
+STRIPE_FAKE = os.getenv('STRIPE_FAKE') == 'True'
 
 # Application definition
 
@@ -44,6 +55,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     'drf_spectacular',
     'django_filters',
     "rest_framework",
@@ -58,14 +70,22 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Сжатие ответов: до middleware, которые читают или изменяют тело ответа
+    "config.compression.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "config.replicas.PrimaryStickinessMiddleware",
 ]
 
+# Способы сжатия ответов в порядке предпочтения (br и zstd - при установленных Brotli и zstandard)
+# и минимальный размер сжимаемого ответа в байтах
+RESPONSE_COMPRESSION_ENCODINGS = (os.getenv("RESPONSE_COMPRESSION_ENCODINGS") or "br,zstd,gzip").split(",")
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE") or 1024)
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -95,11 +115,53 @@ DATABASES = {
         "NAME": os.getenv("DATABASE_NAME"),
         "USER": os.getenv("DATABASE_USER"),
         "HOST": os.getenv("DATABASE_HOST"),
-        "PORT": 5432,
+        "PORT": os.getenv("DATABASE_PORT") or 5432,
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
+        # Постоянные соединения: соединение переиспользуется запросами и задачами Celery,
+        # пока не истечёт CONN_MAX_AGE секунд (0 - новое соединение на каждый запрос).
+        # Перед повторным использованием соединение проверяется, разорванное открывается заново.
+        "CONN_MAX_AGE": int(os.getenv("DATABASE_CONN_MAX_AGE") or 60),
+        "CONN_HEALTH_CHECKS": os.getenv("DATABASE_CONN_HEALTH_CHECKS", "True") != "False",
+        # За пулером соединений в режиме транзакций (PgBouncer) серверные курсоры нужно отключить
+        "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DATABASE_DISABLE_SERVER_SIDE_CURSORS") == "True",
+        "OPTIONS": {
+            "connect_timeout": int(os.getenv("DATABASE_CONNECT_TIMEOUT") or 5),
+        },
     }
 }
 
+# Реплика для чтения: используется представлениями с config.replicas.ReplicaReadMixin.
+# Не заданные параметры берутся из основной бд, в тестах реплика - зеркало основной бд.
+if os.getenv("DATABASE_REPLICA_HOST") or os.getenv("DATABASE_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.getenv("DATABASE_REPLICA_NAME") or DATABASES["default"]["NAME"],
+        "HOST": os.getenv("DATABASE_REPLICA_HOST") or DATABASES["default"]["HOST"],
+        "PORT": os.getenv("DATABASE_REPLICA_PORT") or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["config.replicas.ReplicaRouter"]
+# Сколько секунд после изменения данных пользователь читает из основной бд (задержка репликации)
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv("DATABASE_REPLICA_STICKY_SECONDS") or 10)
+
+# Кэш: общий для всех процессов Redis (индекс доступных велосипедов, кэш ответов, роли и состояние
+# пользователей), без CACHE_REDIS_URL - память процесса (локальная разработка и тесты)
+if os.getenv("CACHE_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("CACHE_REDIS_URL"),
+            "KEY_PREFIX": "bike_rental",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -144,9 +206,15 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "users.User"
 
 REST_FRAMEWORK = {
+    # JSON кодируется orjson, browsable API доступен только при DEBUG
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
-        "rest_framework.renderers.BrowsableAPIRenderer",
+        "config.renderers.ORJSONRenderer",
+        *(["rest_framework.renderers.BrowsableAPIRenderer"] if DEBUG else []),
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "config.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ],
     # django filters
     'DEFAULT_FILTER_BACKENDS': (
@@ -154,7 +222,7 @@ REST_FRAMEWORK = {
     ),
     # Настройки JWT-токенов
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.ClaimsJWTAuthentication",
     ),
     # настройки доступа
     "DEFAULT_PERMISSION_CLASSES": [
@@ -227,4 +295,21 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_STORE_ERRORS_EVEN_IF_IGNORED = False
-CELERY_TASK_ALWAYS_EAGER = True
+# Задачи выполняются воркером Celery. CELERY_TASK_ALWAYS_EAGER=True - синхронно в процессе запроса,
+# только для локальной разработки без воркера
+CELERY_TASK_ALWAYS_EAGER = os.getenv("CELERY_TASK_ALWAYS_EAGER") == "True"
+# Периодические задачи: повторные попытки и потерянные задачи очереди платежей, событий Stripe и расчёта стоимости аренд
+CELERY_BEAT_SCHEDULE = {
+    "process-payment-outbox": {
+        "task": "users.tasks.process_payment_outbox",
+        "schedule": 60,
+    },
+    "process-stripe-events": {
+        "task": "users.tasks.process_stripe_events",
+        "schedule": 60,
+    },
+    "retry-rental-costs": {
+        "task": "rents.tasks.retry_rental_costs",
+        "schedule": 60,
+    },
+}
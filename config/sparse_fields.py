@@ -0,0 +1,91 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = "fields"
+
+
+def project_queryset(queryset, serializer_fields, extra_paths=()):
+    """
+    Ограничивает запрос колонками, нужными полям сериалайзера, и колонками extra_paths.
+
+    Источник каждого поля (source) переводится в путь для only(), связанные модели из источников
+    загружаются через select_related, остальные связи запроса отбрасываются. Если источник поля
+    не является полем модели (свойство, метод, source="*"), запрос не меняется.
+    """
+    paths = {queryset.model._meta.pk.name, *extra_paths}
+    related = set()
+    for field in serializer_fields:
+        if field.source == "*":
+            return queryset
+
+        model = queryset.model
+        parts = field.source.split(".")
+        for index, part in enumerate(parts):
+            try:
+                model_field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return queryset
+            path = "__".join(parts[:index + 1])
+            if not model_field.is_relation:
+                break
+            if model_field.many_to_many or model_field.one_to_many:
+                return queryset
+            # Связанный объект нужен целиком для str() или как промежуточное звено источника
+            related.add(path)
+            model = model_field.related_model
+        paths.add(path)
+
+    return queryset.select_related(None).select_related(*related).only(*paths)
+
+
+class SparseFieldsMixin:
+    """
+    Выборочные поля ответа: ?fields=id,type,rental_cost_hour.
+
+    Для безопасных методов оставляет в сериалайзере только перечисленные поля (в порядке полей
+    сериалайзера) и загружает из бд только их колонки. Неизвестное поле - ошибка 400.
+    """
+
+    def get_requested_fields(self):
+        """Возвращает запрошенные поля или None, если ответ не ограничен."""
+        if not hasattr(self, "_requested_fields"):
+            self._requested_fields = self._parse_requested_fields()
+        return self._requested_fields
+
+    def _parse_requested_fields(self):
+        value = self.request.query_params.get(FIELDS_PARAM)
+        if not value or self.request.method not in SAFE_METHODS:
+            return None
+
+        requested = {name.strip() for name in value.split(",") if name.strip()}
+        available = list(self.get_serializer_class()().fields)
+        unknown = requested - set(available)
+        if unknown:
+            raise ValidationError({FIELDS_PARAM: [f"Unknown fields: {', '.join(sorted(unknown))}."]})
+        return [name for name in available if name in requested]
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_requested_fields()
+        if fields:
+            serializer_fields = self.get_serializer_class()().fields
+            # Курсорная пагинация читает поля сортировки из объектов страницы
+            ordering = getattr(self.paginator, "ordering", None) or ()
+            if isinstance(ordering, str):
+                ordering = (ordering,)
+            queryset = project_queryset(
+                queryset,
+                [serializer_fields[name] for name in fields],
+                [name.lstrip("-") for name in ordering],
+            )
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.get_requested_fields()
+        if fields:
+            child = getattr(serializer, "child", serializer)
+            for name in set(child.fields) - set(fields):
+                child.fields.pop(name)
+        return serializer
@@ -15,6 +15,7 @@ class UserAdmin(admin.ModelAdmin):
         "renter",
         "status",
         "rental_cost",
+        "pricing_status",
     )
     list_display_links = ("pk", "start_time")
     ordering = ("start_time", "end_time")
@@ -0,0 +1,17 @@
+from rents.models import Rental
+
+# Колонки выгрузки аренд: название колонки - путь к полю для values_list
+RENTAL_COLUMNS = {
+    "id": "id",
+    "renter": "renter__email",
+    "bike": "rented_bike_id",
+    "start_time": "start_time",
+    "end_time": "end_time",
+    "status": "status",
+    "rental_cost": "rental_cost",
+    "pricing_status": "pricing_status",
+}
+
+
+def rental_export_queryset():
+    return Rental.objects.order_by("id")
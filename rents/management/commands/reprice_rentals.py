@@ -0,0 +1,118 @@
+import time
+from decimal import Decimal
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from rents.models import Rental
+from rents.utils import CENT, calculate_rental_costs_cents
+from users.models import Payment
+
+
+class Command(BaseCommand):
+    """
+    Custom management command to recalculate the cost of finished, unpaid rentals.
+    python manage.py reprice_rentals [--chunk-size N] [--start-id ID] [--dry-run] [--include-completed]
+
+    By default only rentals pending payment that have no payment yet are repriced: paid
+    (completed) rentals keep their historical amount unless --include-completed is given.
+    Rentals whose cost is being calculated by the get_rental_cost task are skipped, both
+    when reading and, under a row lock, when writing.
+
+    Rentals are read in chunks ordered by primary key (keyset pagination), with the
+    tariffs of the rented bike joined in the same query, so memory usage does not
+    depend on the size of the table. Each chunk is priced in one pass and only the rows
+    whose cost has changed are written back with a single bulk_update.
+    """
+
+    help = "Recalculate rental costs for finished, unpaid rentals"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Number of rentals per chunk")
+        parser.add_argument("--start-id", type=int, default=0, help="Process rentals with id greater than this")
+        parser.add_argument("--dry-run", action="store_true", help="Report differences without saving them")
+        parser.add_argument(
+            "--include-completed", action="store_true",
+            help="Also reprice completed (paid) rentals at current tariffs, rewriting their historical cost",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_id = options["start_id"]
+        dry_run = options["dry_run"]
+
+        statuses = ["pending", "completed"] if options["include_completed"] else ["pending"]
+        eligible = Rental.objects.filter(status__in=statuses).exclude(pricing_status="calculating")
+        if not options["include_completed"]:
+            # Сумма выставленного платежа уже зафиксирована
+            eligible = eligible.exclude(Exists(Payment.objects.filter(rental=OuterRef("pk"))))
+
+        rentals = (
+            eligible.filter(end_time__isnull=False, rented_bike__isnull=False)
+            .order_by("id")
+            .values_list(
+                "id",
+                "start_time",
+                "end_time",
+                "rental_cost",
+                "pricing_status",
+                "rented_bike__rental_cost_hour",
+                "rented_bike__rental_cost_day",
+            )
+        )
+
+        processed = changed = 0
+        total_diff = Decimal("0.00")
+        started = time.monotonic()
+
+        while True:
+            chunk = list(rentals.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+
+            ids, start_times, end_times, old_costs, pricing_statuses, costs_hour, costs_day = zip(*chunk)
+            new_costs = calculate_rental_costs_cents(start_times, end_times, costs_hour, costs_day)
+
+            differences = {}
+            for rental_id, old_cost, pricing_status, cents in zip(ids, old_costs, pricing_statuses, new_costs):
+                new_cost = Decimal(cents) * CENT
+                if old_cost != new_cost or pricing_status != "calculated":
+                    differences[rental_id] = (old_cost, new_cost)
+
+            if differences and not dry_run:
+                with transaction.atomic():
+                    # Аренды, которые после чтения взяты в расчёт или оплачены, не перезаписываются
+                    locked = set(
+                        eligible.filter(id__in=differences)
+                        .select_for_update(skip_locked=True)
+                        .values_list("id", flat=True)
+                    )
+                    differences = {rental_id: costs for rental_id, costs in differences.items() if rental_id in locked}
+                    Rental.objects.bulk_update(
+                        [
+                            Rental(id=rental_id, rental_cost=new_cost, pricing_status="calculated",
+                                   pricing_next_attempt_at=None)
+                            for rental_id, (_, new_cost) in differences.items()
+                        ],
+                        ["rental_cost", "pricing_status", "pricing_next_attempt_at"],
+                    )
+
+            for rental_id, (old_cost, new_cost) in differences.items():
+                total_diff += new_cost - (old_cost or 0)
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"Rental {rental_id}: {old_cost} -> {new_cost}")
+
+            processed += len(chunk)
+            changed += len(differences)
+            last_id = ids[-1]
+
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else processed
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {processed} rentals in {elapsed:.2f}s ({rate:.0f} rentals/s), "
+                f"changed {changed}, total difference {total_diff}"
+                + (" (dry run, nothing saved)" if dry_run else "")
+            )
+        )
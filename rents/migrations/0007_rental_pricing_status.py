@@ -0,0 +1,36 @@
+# Generated by Django 5.0.7 on 2026-10-18 02:52
+
+from django.db import migrations, models
+
+
+def mark_existing_rentals_calculated(apps, schema_editor):
+    """Завершённые ранее аренды уже имеют рассчитанную стоимость."""
+    Rental = apps.get_model("rents", "Rental")
+    Rental.objects.exclude(status="active").update(pricing_status="calculated")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rents", "0006_alter_rental_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rental",
+            name="pricing_status",
+            field=models.CharField(
+                choices=[
+                    ("not_calculated", "Not calculated"),
+                    ("calculating", "Calculating"),
+                    ("calculated", "Calculated"),
+                    ("failed", "Failed"),
+                ],
+                default="not_calculated",
+                max_length=14,
+            ),
+        ),
+        migrations.RunPython(
+            mark_existing_rentals_calculated, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.7 on 2026-10-18 02:53
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def close_duplicate_active_rentals(apps, schema_editor):
+    """
+    Завершает лишние активные аренды пользователей перед созданием ограничения.
+
+    У пользователя остаётся активной последняя аренда, более ранние завершаются временем её начала
+    и ожидают оплаты (стоимость рассчитывается повторным расчётом), их велосипеды освобождаются.
+    """
+    Rental = apps.get_model("rents", "Rental")
+    Bicycle = apps.get_model("bikes", "Bicycle")
+
+    renters = list(
+        Rental.objects.filter(status="active", renter__isnull=False)
+        .values("renter")
+        .annotate(count=models.Count("id"))
+        .filter(count__gt=1)
+        .values_list("renter", flat=True)
+    )
+    for renter_id in renters:
+        kept, *duplicates = Rental.objects.filter(status="active", renter_id=renter_id).order_by("-start_time", "-id")
+        for rental in duplicates:
+            rental.status = "pending"
+            rental.end_time = kept.start_time
+            rental.pricing_status = "failed"
+            rental.save(update_fields=["status", "end_time", "pricing_status"])
+            if rental.rented_bike_id and not Rental.objects.filter(
+                status="active", rented_bike_id=rental.rented_bike_id
+            ).exists():
+                Bicycle.objects.filter(id=rental.rented_bike_id).update(is_rented=False)
+            logger.warning(
+                f"Duplicate active rental {rental.pk} of user {renter_id} is closed, rental {kept.pk} is kept."
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bikes", "0002_rename_rented_bicycle_is_rented"),
+        ("rents", "0007_rental_pricing_status"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_rentals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="rental",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "active")),
+                fields=("renter",),
+                name="unique_active_rental_per_renter",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 02:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bikes", "0002_rename_rented_bicycle_is_rented"),
+        ("rents", "0008_rental_unique_active_rental_per_renter"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rental",
+            index=models.Index(
+                fields=["-start_time", "-id"], name="rental_start_time_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rental",
+            index=models.Index(
+                fields=["renter", "-start_time", "-id"],
+                name="rental_renter_start_time_idx",
+            ),
+        ),
+    ]
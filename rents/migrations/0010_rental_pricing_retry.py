@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def queue_unpriced_rentals(apps, schema_editor):
+    """Аренды, стоимость которых не удалось рассчитать ранее, попадают в очередь повторного расчёта."""
+    Rental = apps.get_model("rents", "Rental")
+    Rental.objects.filter(status="pending", pricing_status__in=["calculating", "failed"]).update(
+        pricing_next_attempt_at=now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bikes", "0003_bicycle_bicycle_available_idx_and_more"),
+        ("rents", "0009_rental_rental_start_time_id_idx_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rental",
+            name="pricing_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="rental",
+            name="pricing_next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="rental",
+            index=models.Index(
+                condition=models.Q(
+                    ("pricing_status__in", ["calculating", "failed"]),
+                    ("status", "pending"),
+                ),
+                fields=["pricing_next_attempt_at"],
+                name="rental_pricing_retry_idx",
+            ),
+        ),
+        migrations.RunPython(queue_unpriced_rentals, migrations.RunPython.noop),
+    ]
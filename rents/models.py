@@ -13,6 +13,13 @@ class Rental(models.Model):
         ("completed", "Completed"),
     ]
 
+    PRICING_STATUS_CHOICES = [
+        ("not_calculated", "Not calculated"),
+        ("calculating", "Calculating"),
+        ("calculated", "Calculated"),
+        ("failed", "Failed"),
+    ]
+
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(null=True, blank=True)
     rented_bike = models.ForeignKey(
@@ -27,6 +34,12 @@ class Rental(models.Model):
     rental_cost = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True, default=0
     )
+    pricing_status = models.CharField(
+        max_length=14, choices=PRICING_STATUS_CHOICES, default="not_calculated"
+    )
+    # Неудачные и потерянные расчёты стоимости повторяются периодической задачей
+    pricing_attempts = models.PositiveSmallIntegerField(default=0)
+    pricing_next_attempt_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.rented_bike} - {self.renter} - {self.status}"
@@ -34,3 +47,22 @@ class Rental(models.Model):
     class Meta:
         verbose_name = "rental"
         verbose_name_plural = "rentals"
+        indexes = [
+            # Курсорная пагинация списка аренд и истории аренды пользователя
+            models.Index(fields=["-start_time", "-id"], name="rental_start_time_id_idx"),
+            models.Index(fields=["renter", "-start_time", "-id"], name="rental_renter_start_time_idx"),
+            # Очередь повторного расчёта стоимости
+            models.Index(
+                fields=["pricing_next_attempt_at"],
+                name="rental_pricing_retry_idx",
+                condition=models.Q(status="pending", pricing_status__in=["calculating", "failed"]),
+            ),
+        ]
+        constraints = [
+            # У пользователя может быть только одна активная аренда
+            models.UniqueConstraint(
+                fields=["renter"],
+                condition=models.Q(status="active"),
+                name="unique_active_rental_per_renter",
+            ),
+        ]
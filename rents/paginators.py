@@ -1,7 +1,10 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination
 
 
-class RentalPaginator(PageNumberPagination):
+class RentalPaginator(CursorPagination):
+    """ Курсорная пагинация для списка аренд: без COUNT(*) и OFFSET на больших таблицах. """
+
     page_size = 2
     page_size_query_param = 'page_size'
     max_page_size = 5
+    ordering = ('-start_time', '-id')
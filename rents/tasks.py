@@ -1,26 +1,83 @@
 import logging
+from datetime import timedelta
 
 from celery import shared_task
+from django.db import transaction
+from django.utils.timezone import now
 
 from rents.models import Rental
 from rents.utils import calculate_rental_cost
 
 logger = logging.getLogger(__name__)
 
+MAX_PRICING_ATTEMPTS = 5
+PRICING_RETRY_DELAY = timedelta(seconds=30)
+# Расчёт, не завершённый за это время (задача потеряна), повторяется
+PRICING_TIMEOUT = timedelta(minutes=5)
+RETRY_BATCH_SIZE = 500
+
 
 @shared_task
 def get_rental_cost(rental_id):
     """
     Фоновая задача для расчета платы за аренду велосипеда.
 
-    Получает объект аренды, вызывает функцию расчета
-    стоимости и возвращает результат. Если возникает ошибка, возвращает сообщение
-    об ошибке.
+    Получает объект аренды, вызывает функцию расчета стоимости и сохраняет
+    результат в записи об аренде, переводя её статус расчёта в 'calculated'.
+    Если возникает ошибка, статус расчёта становится 'failed', а задача
+    возвращает сообщение об ошибке. Расчёт повторяется задачей retry_rental_costs
+    с экспоненциальной задержкой, всего не более MAX_PRICING_ATTEMPTS попыток.
     """
     try:
-        rental = Rental.objects.get(id=rental_id)
+        rental = Rental.objects.select_related("rented_bike").get(id=rental_id)
         payment = calculate_rental_cost(rental)
+        if payment is None:
+            raise ValueError(f"Rental {rental_id} is not pending payment.")
+
+        # Сохраняем стоимость, только если аренда всё ещё ожидает оплаты
+        Rental.objects.filter(id=rental_id, status="pending").update(
+            rental_cost=payment, pricing_status="calculated", pricing_next_attempt_at=None
+        )
+        logger.info(f"Payment for rental {rental_id} is successfully calculated.")
         return {"status": "success", "rental_cost": float(payment)}
     except Exception as e:
+        attempts = (Rental.objects.filter(id=rental_id).values_list("pricing_attempts", flat=True).first() or 0) + 1
+        next_attempt_at = None
+        if attempts < MAX_PRICING_ATTEMPTS:
+            next_attempt_at = now() + PRICING_RETRY_DELAY * 2 ** (attempts - 1)
+        Rental.objects.filter(id=rental_id).update(
+            pricing_status="failed", pricing_attempts=attempts, pricing_next_attempt_at=next_attempt_at
+        )
         logger.error(f"Error occurred while calculating cost for {rental_id}.")
         return {"error": str(e)}
+
+
+@shared_task
+def retry_rental_costs(batch_size=RETRY_BATCH_SIZE):
+    """
+    Периодическая задача повторного расчёта стоимости аренд.
+
+    Ставит в очередь get_rental_cost для аренд, ожидающих оплаты, расчёт которых завершился
+    ошибкой или не завершился за PRICING_TIMEOUT. Строки блокируются с SKIP LOCKED, поэтому
+    параллельные запуски не ставят в очередь одни и те же аренды.
+    """
+    with transaction.atomic():
+        ids = list(
+            Rental.objects.filter(
+                status="pending",
+                pricing_status__in=["calculating", "failed"],
+                pricing_next_attempt_at__lte=now(),
+            )
+            .order_by("pricing_next_attempt_at")
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Rental.objects.filter(id__in=ids).update(
+            pricing_status="calculating", pricing_next_attempt_at=now() + PRICING_TIMEOUT
+        )
+
+    for rental_id in ids:
+        get_rental_cost.delay(rental_id)
+    if ids:
+        logger.info(f"Cost calculation is queued again for {len(ids)} rentals.")
+    return {"queued": len(ids)}
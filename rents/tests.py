@@ -1,17 +1,32 @@
+import importlib
 from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 from model_bakery import baker
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
 from bikes.models import Bicycle
+from config.replicas import (ReplicaRouter, primary_reads,
+                             replica_is_configured, replica_reads)
 from rents.models import Rental
-from users.models import User
+from rents.tasks import (MAX_PRICING_ATTEMPTS, get_rental_cost,
+                         retry_rental_costs)
+from rents.utils import calculate_rental_cost, calculate_rental_costs
+from users.models import Payment, User
 
 
 class RentTestcase(TestCase):
@@ -49,6 +64,16 @@ class RentTestcase(TestCase):
         bike_from_db = Bicycle.objects.get(pk=self.bike1.pk)
         self.assertTrue(bike_from_db.is_rented)
 
+    def test_rent_bike_queries(self):
+        """Тестирование количества запросов к бд при создании аренды."""
+
+        url = reverse("rents:rent-bike", kwargs={"bike_id": self.bike1.pk})
+
+        # Блокировка велосипеда, вставка аренды и обновление велосипеда (+ точка сохранения транзакции)
+        with self.assertNumQueries(5):
+            response = self.client.post(url, {"renter": self.user2.pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
     def test_rent_unavailable_bike(self):
         """Тестирование попытки аренды недоступного велосипеда."""
 
@@ -93,11 +118,17 @@ class RentTestcase(TestCase):
             self.assertEqual(item["error_detail"], "User already has an active rental.")
             self.assertEqual(item['code'], 'invalid')
 
+        # Велосипед остаётся доступным после отклонённой аренды
+        self.bike1.refresh_from_db()
+        self.assertFalse(self.bike1.is_rented)
+        self.assertEqual(Rental.objects.filter(renter=self.user2, status="active").count(), 1)
+
 
 class TestRentApiViews(APITestCase):
     """ Тестовые случаи для API-представлений аренд."""
 
     def setUp(self):
+        cache.clear()
         self.user = baker.make(User)
         self.client.force_authenticate(user=self.user)
 
@@ -120,9 +151,9 @@ class TestRentApiViews(APITestCase):
         self.client.force_authenticate(user=self.moder)
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['rented_bike'], str(self.bike))
-        self.assertEqual(response.data[0]['renter'], str(self.user))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['rented_bike'], str(self.bike))
+        self.assertEqual(response.data['results'][0]['renter'], str(self.user))
 
     def test_retrieve_view(self):
         """ Тест получения информации о конкретной аренде."""
@@ -133,6 +164,68 @@ class TestRentApiViews(APITestCase):
         self.assertEqual(response.data['rented_bike'], str(self.bike))
         self.assertEqual(response.data['renter'], str(self.user))
 
+    def test_list_view_queries(self):
+        """ Тест: количество запросов к бд не зависит от количества аренд."""
+
+        self.client.force_authenticate(user=self.moder)
+        for _ in range(10):
+            baker.make(Rental, renter=baker.make(User), rented_bike=baker.make(Bicycle))
+
+        # Проверка группы модератора и выборка аренд вместе с пользователями и велосипедами
+        with self.assertNumQueries(2):
+            response = self.client.get(self.list_url, {'page_size': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 5)
+
+        # Роль модератора берётся из кэша
+        with self.assertNumQueries(1):
+            self.client.get(self.list_url, {'page_size': 5})
+
+    def test_list_view_fields(self):
+        """ Тест выборочных полей списка аренд: в запросе к бд только нужные колонки и связи."""
+
+        self.client.force_authenticate(user=self.moder)
+        for _ in range(3):
+            baker.make(Rental, renter=baker.make(User), rented_bike=baker.make(Bicycle))
+
+        self.client.get(self.list_url)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(self.list_url, {'fields': 'id,rented_bike,status', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'rented_bike', 'status'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('users_user', queries[0]['sql'])
+        self.assertNotIn('"rents_rental"."rental_cost"', queries[0]['sql'])
+        first = response.data['results'][0]
+        self.assertEqual(first['rented_bike'], str(Rental.objects.get(pk=first['id']).rented_bike))
+        self.assertIsNotNone(response.data['next'])
+
+    def test_list_view_cursor_pagination(self):
+        """ Тест курсорной пагинации списка аренд: страницы не пересекаются."""
+
+        self.client.force_authenticate(user=self.moder)
+        baker.make(Rental, _quantity=4)
+
+        response = self.client.get(self.list_url)
+        first_page = [rental['id'] for rental in response.data['results']]
+        self.assertNotIn('count', response.data)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        second_page = [rental['id'] for rental in response.data['results']]
+        self.assertEqual(len(first_page), 2)
+        self.assertEqual(len(second_page), 2)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertEqual(first_page + second_page, sorted(first_page + second_page, reverse=True))
+
+    def test_retrieve_view_queries(self):
+        """ Тест: просмотр аренды выполняется одним запросом к бд."""
+
+        self.client.force_authenticate(user=self.moder)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.retrieve_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_unauthenticated_access(self):
         """ Тест доступа без аутентификации к списку аренд."""
 
@@ -183,6 +276,35 @@ class TestReturnView(APITestCase):
         available_bike = Bicycle.objects.get(pk=self.bike.pk)
         self.assertFalse(available_bike.is_rented)
 
+    def test_return_bike_does_not_wait_for_cost(self):
+        """ Тест возврата велосипеда: стоимость рассчитывается в фоне после ответа."""
+
+        # start_time заполняется автоматически, поэтому сдвигаем его напрямую
+        Rental.objects.filter(pk=self.rental.pk).update(start_time=now() - timedelta(minutes=90))
+        url = reverse('rents:return-bike', kwargs={'pk': self.rental.pk})
+        self.client.force_authenticate(user=self.user1)
+
+        with mock.patch("rents.views.get_rental_cost.delay") as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.patch(url, {'status': 'completed'})
+
+            # Ответ возвращается до постановки задачи в очередь
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['pricing_status'], 'calculating')
+            delay.assert_not_called()
+
+            # После фиксации транзакции задача только ставится в очередь, расчёт выполняет воркер
+            for callback in callbacks:
+                callback()
+            delay.assert_called_once_with(self.rental.pk)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, 'calculating')
+
+        get_rental_cost(self.rental.pk)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, 'calculated')
+        self.assertEqual(self.rental.rental_cost, 2 * self.bike.rental_cost_hour)
+
     def test_not_authorized_to_return(self):
         """ Тест попытки возврата велосипеда пользователем без прав."""
 
@@ -216,3 +338,250 @@ class TestReturnView(APITestCase):
         url = reverse('rents:return-bike', kwargs={'pk': self.rental.pk})
         response = self.client.patch(url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DuplicateActiveRentalsMigrationTestCase(TestCase):
+    """ Тест подготовки данных к ограничению unique_active_rental_per_renter."""
+
+    def test_duplicates_are_closed(self):
+        """ Тест: у пользователя остаётся одна активная аренда, ограничение создаётся."""
+
+        constraint = next(c for c in Rental._meta.constraints if c.name == "unique_active_rental_per_renter")
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Rental, constraint)
+
+        user = baker.make(User)
+        bikes = baker.make(Bicycle, is_rented=True, _quantity=2)
+        older = baker.make(Rental, renter=user, rented_bike=bikes[0], status="active")
+        newer = baker.make(Rental, renter=user, rented_bike=bikes[1], status="active")
+        Rental.objects.filter(pk=older.pk).update(start_time=now() - timedelta(hours=1))
+        newer.refresh_from_db()
+
+        migration = importlib.import_module("rents.migrations.0008_rental_unique_active_rental_per_renter")
+        migration.close_duplicate_active_rentals(apps, None)
+
+        older.refresh_from_db()
+        self.assertEqual(older.status, "pending")
+        self.assertEqual(older.end_time, newer.start_time)
+        self.assertEqual(older.pricing_status, "failed")
+        self.assertEqual(Rental.objects.get(pk=newer.pk).status, "active")
+        self.assertFalse(Bicycle.objects.get(pk=bikes[0].pk).is_rented)
+        self.assertTrue(Bicycle.objects.get(pk=bikes[1].pk).is_rented)
+
+        # Отложенные проверки внешних ключей не дают изменять таблицу в той же транзакции
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        with connection.schema_editor() as editor:
+            editor.add_constraint(Rental, constraint)
+
+
+class RentalCostTestCase(TestCase):
+    """ Тестовые случаи для функций расчёта стоимости аренды."""
+
+    def setUp(self):
+        self.bike = baker.make(Bicycle, rental_cost_hour=Decimal("2.50"), rental_cost_day=Decimal("30.00"))
+        self.start = now()
+
+    def test_batch_cost(self):
+        """ Тест пакетного расчёта стоимости почасовой и посуточной аренды."""
+
+        end_times = [
+            self.start + timedelta(minutes=30),
+            self.start + timedelta(hours=24),
+            self.start + timedelta(hours=50, minutes=1),
+        ]
+        costs = calculate_rental_costs(
+            [self.start] * 3, end_times, [self.bike.rental_cost_hour] * 3, [self.bike.rental_cost_day] * 3
+        )
+        self.assertEqual(costs, [Decimal("2.50"), Decimal("60.00"), Decimal("67.50")])
+        self.assertEqual([str(cost) for cost in costs], ["2.50", "60.00", "67.50"])
+
+    def test_single_cost_matches_batch(self):
+        """ Тест совпадения расчёта одной аренды с пакетным расчётом."""
+
+        rental = baker.make(
+            Rental, rented_bike=self.bike, status="pending", end_time=self.start + timedelta(hours=30)
+        )
+        expected = calculate_rental_costs(
+            [rental.start_time], [rental.end_time], [self.bike.rental_cost_hour], [self.bike.rental_cost_day]
+        )
+        self.assertEqual(calculate_rental_cost(rental), expected[0])
+
+        rental.status = "active"
+        self.assertIsNone(calculate_rental_cost(rental))
+
+
+class RentalCostRetryTestCase(TestCase):
+    """ Тестовые случаи для повторного расчёта стоимости аренды."""
+
+    def setUp(self):
+        self.bike = baker.make(Bicycle, rental_cost_hour=Decimal("2.50"))
+        self.rental = baker.make(
+            Rental, rented_bike=None, status="pending", pricing_status="calculating",
+            end_time=now() + timedelta(minutes=30),
+        )
+
+    def test_failed_cost_is_retried(self):
+        """ Тест повторного расчёта после ошибки: задача ставится в очередь после задержки."""
+
+        get_rental_cost(self.rental.pk)  # велосипед не указан - ошибка расчёта
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, "failed")
+        self.assertEqual(self.rental.pricing_attempts, 1)
+        self.assertGreater(self.rental.pricing_next_attempt_at, now())
+
+        with mock.patch("rents.tasks.get_rental_cost.delay") as delay:
+            self.assertEqual(retry_rental_costs()["queued"], 0)
+            Rental.objects.filter(pk=self.rental.pk).update(
+                rented_bike=self.bike, pricing_next_attempt_at=now() - timedelta(seconds=1)
+            )
+            self.assertEqual(retry_rental_costs()["queued"], 1)
+        delay.assert_called_once_with(self.rental.pk)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, "calculating")
+
+        get_rental_cost(self.rental.pk)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, "calculated")
+        self.assertIsNone(self.rental.pricing_next_attempt_at)
+
+    def test_lost_calculation_is_retried(self):
+        """ Тест повторного расчёта, задача которого не завершилась за отведённое время."""
+
+        Rental.objects.filter(pk=self.rental.pk).update(pricing_next_attempt_at=now() - timedelta(seconds=1))
+        with mock.patch("rents.tasks.get_rental_cost.delay") as delay:
+            self.assertEqual(retry_rental_costs()["queued"], 1)
+        delay.assert_called_once_with(self.rental.pk)
+
+    def test_attempts_are_limited(self):
+        """ Тест: после MAX_PRICING_ATTEMPTS неудачных попыток расчёт больше не повторяется."""
+
+        Rental.objects.filter(pk=self.rental.pk).update(pricing_attempts=MAX_PRICING_ATTEMPTS - 1)
+        get_rental_cost(self.rental.pk)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.pricing_status, "failed")
+        self.assertIsNone(self.rental.pricing_next_attempt_at)
+
+
+class RepriceRentalsCommandTestCase(TestCase):
+    """ Тестовые случаи для команды перерасчёта стоимости аренд."""
+
+    def setUp(self):
+        self.bike = baker.make(Bicycle, rental_cost_hour=Decimal("2.50"), rental_cost_day=Decimal("30.00"))
+        self.rentals = baker.make(
+            Rental, rented_bike=self.bike, status="pending", pricing_status="calculated",
+            rental_cost=Decimal("2.50"), _quantity=5,
+        )
+        # Аренды длились по два часа
+        for rental in self.rentals:
+            Rental.objects.filter(pk=rental.pk).update(end_time=rental.start_time + timedelta(minutes=90))
+        Rental.objects.filter(pk=self.rentals[0].pk).update(rental_cost=Decimal("5.00"))
+        self.active = baker.make(Rental, rented_bike=self.bike, status="active")
+
+    def test_reprice_changed_rentals(self):
+        """ Тест перерасчёта: сохраняются только изменившиеся аренды."""
+
+        out = StringIO()
+        call_command("reprice_rentals", chunk_size=2, stdout=out)
+
+        self.assertIn("Processed 5 rentals", out.getvalue())
+        self.assertIn("changed 4", out.getvalue())
+        costs = set(Rental.objects.filter(status="pending").values_list("rental_cost", flat=True))
+        self.assertEqual(costs, {Decimal("5.00")})
+
+        # Активная аренда не пересчитывается
+        self.active.refresh_from_db()
+        self.assertEqual(self.active.rental_cost, 0)
+
+    def test_reprice_dry_run(self):
+        """ Тест перерасчёта без сохранения результатов."""
+
+        out = StringIO()
+        call_command("reprice_rentals", dry_run=True, stdout=out)
+
+        self.assertIn("changed 4", out.getvalue())
+        self.assertEqual(Rental.objects.filter(rental_cost=Decimal("2.50")).count(), 4)
+
+    def test_reprice_skips_paid_and_calculating(self):
+        """ Тест: оплаченные аренды, аренды с платежом и аренды в расчёте не пересчитываются."""
+
+        completed, calculating, with_payment = self.rentals[1:4]
+        Rental.objects.filter(pk=completed.pk).update(status="completed")
+        Rental.objects.filter(pk=calculating.pk).update(pricing_status="calculating")
+        baker.make(Payment, rental=with_payment, amount=Decimal("2.50"))
+
+        out = StringIO()
+        call_command("reprice_rentals", stdout=out)
+        self.assertIn("Processed 2 rentals", out.getvalue())
+        self.assertIn("changed 1", out.getvalue())
+        for rental in (completed, calculating, with_payment):
+            self.assertEqual(Rental.objects.get(pk=rental.pk).rental_cost, Decimal("2.50"))
+
+        # Оплаченные аренды пересчитываются только явно
+        call_command("reprice_rentals", include_completed=True, stdout=out)
+        self.assertEqual(Rental.objects.get(pk=completed.pk).rental_cost, Decimal("5.00"))
+        self.assertEqual(Rental.objects.get(pk=calculating.pk).rental_cost, Decimal("2.50"))
+
+
+class ReplicaRoutingTest(APITransactionTestCase):
+    """Тесты чтения из реплики и закрепления пользователя за основной бд после записи."""
+
+    databases = {"default", "replica"} if replica_is_configured() else {"default"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = baker.make(User)
+        self.client.force_authenticate(user=self.user)
+        self.bike = baker.make(Bicycle, is_rented=False)
+
+    def test_router(self):
+        """Тест: реплика используется только внутри replica_reads, вне транзакции и если она настроена."""
+
+        router = ReplicaRouter()
+        databases = {**settings.DATABASES, "replica": settings.DATABASES["default"]}
+        with override_settings(DATABASES=databases):
+            self.assertIsNone(router.db_for_read(Rental))
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Rental), "replica")
+                self.assertEqual(router.db_for_write(Rental), "default")
+                with transaction.atomic():
+                    self.assertIsNone(router.db_for_read(Rental))
+                with primary_reads():
+                    self.assertIsNone(router.db_for_read(Rental))
+                self.assertEqual(router.db_for_read(Rental), "replica")
+            self.assertFalse(router.allow_migrate("replica", "rents"))
+
+        databases = {"default": settings.DATABASES["default"]}
+        with override_settings(DATABASES=databases), replica_reads():
+            self.assertIsNone(router.db_for_read(Rental))
+
+    @skipUnless(replica_is_configured(), "Read replica is not configured")
+    def test_read_your_writes(self):
+        """Тест: история аренды читается из реплики, после своей записи - из основной бд."""
+
+        baker.make(Rental, renter=self.user, status="completed")
+        history_url = reverse("users:user-history")
+        with CaptureQueriesContext(connections["replica"]) as replica_queries:
+            response = self.client.get(history_url)
+        self.assertTrue(replica_queries)
+        self.assertEqual(len(response.data["results"]), 1)
+
+        with CaptureQueriesContext(connections["replica"]) as replica_queries:
+            response = self.client.post(reverse("rents:rent-bike", kwargs={"bike_id": self.bike.pk}))
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.client.get(history_url)
+        self.assertEqual(len(replica_queries), 0)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    @skipUnless(replica_is_configured(), "Read replica is not configured")
+    def test_cache_rebuilds_read_primary(self):
+        """Тест: кэш каталога велосипедов и индекс доступных велосипедов строятся из основной бд."""
+
+        with CaptureQueriesContext(connections["replica"]) as replica_queries:
+            for url in (
+                reverse("bikes:bicycles-list"),
+                reverse("bikes:bicycles-detail", kwargs={"pk": self.bike.pk}),
+                reverse("bikes:available-bikes"),
+            ):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(replica_queries), 0)
@@ -1,30 +1,58 @@
 from decimal import Decimal
 from math import ceil
 
+CENT = Decimal("0.01")
+HOURS_IN_DAY = 24
 
-def calculate_rental_cost(instance):
-    """Функция для расчёта стоимости аренды велосипеда."""
 
-    if instance.status == "pending":
-        duration_sec = (
-                instance.end_time - instance.start_time
-        ).total_seconds()  # время аренды в секундах
-        duration_hours = ceil(duration_sec / 3600)  # время аренды в часах
+def calculate_rental_costs_cents(start_times, end_times, costs_hour, costs_day):
+    """
+    Пакетный расчёт стоимости аренд в центах.
+
+    Принимает последовательности одинаковой длины: время начала и окончания аренды,
+    почасовой и суточный тарифы велосипеда. Тарифы переводятся в целые центы один раз
+    для каждого уникального значения, дальнейший расчёт ведётся в целых числах.
+    """
+    tariff_cents = {}  # кэш перевода тарифов в центы
+
+    def to_cents(value):
+        cents = tariff_cents.get(value)
+        if cents is None:
+            cents = tariff_cents[value] = int(value / CENT)
+        return cents
+
+    costs = []
+    append = costs.append
+    for start, end, cost_hour, cost_day in zip(start_times, end_times, costs_hour, costs_day, strict=True):
+        duration_hours = ceil((end - start).total_seconds() / 3600)  # время аренды в часах
 
         # расчёт стоимости при аренде больше суток
-        if duration_hours > 24:
-            days = duration_hours // 24  # кол-во суток
-            cost_days = (
-                    days * instance.rented_bike.rental_cost_day
-            )  # стоимость за все дни аренды
-            cost_hours = (
-                                 duration_hours % 24
-                         ) * instance.rented_bike.rental_cost_hour  # стоимость за все часы аренды
-            total_cost = Decimal(cost_days) + Decimal(cost_hours)  # общая стоимость за дни и часы
+        if duration_hours > HOURS_IN_DAY:
+            days, hours = divmod(duration_hours, HOURS_IN_DAY)
+            append(days * to_cents(cost_day) + hours * to_cents(cost_hour))
 
         # расчёт стоимости почасовой аренды
         else:
-            total_cost = Decimal(duration_hours * instance.rented_bike.rental_cost_hour)
-        return Decimal(total_cost)
+            append(duration_hours * to_cents(cost_hour))
+    return costs
+
+
+def calculate_rental_costs(start_times, end_times, costs_hour, costs_day):
+    """Пакетный расчёт стоимости аренд, результат - список Decimal с двумя знаками после запятой."""
+
+    return [
+        Decimal(cents) * CENT
+        for cents in calculate_rental_costs_cents(start_times, end_times, costs_hour, costs_day)
+    ]
+
+
+def calculate_rental_cost(instance):
+    """Функция для расчёта стоимости аренды велосипеда."""
+
+    if instance.status == "pending":
+        bike = instance.rented_bike
+        return calculate_rental_costs(
+            [instance.start_time], [instance.end_time], [bike.rental_cost_hour], [bike.rental_cost_day]
+        )[0]
     else:
         return None
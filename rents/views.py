@@ -1,7 +1,7 @@
 import logging
-from decimal import Decimal
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from rest_framework import generics, serializers, status
@@ -9,9 +9,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from bikes.models import Bicycle
+from bikes.services import refresh_bike_availability
+from config.exports import ExportAPIView
+from config.replicas import ReplicaReadMixin
+from config.sparse_fields import SparseFieldsMixin
+from rents.exports import RENTAL_COLUMNS, rental_export_queryset
 from rents.models import Rental
+from rents.paginators import RentalPaginator
 from rents.serializers import RentSerializer
-from rents.tasks import get_rental_cost
+from rents.tasks import PRICING_TIMEOUT, get_rental_cost
 from users.permissions import IsModerator
 
 logger = logging.getLogger(__name__)
@@ -28,59 +34,77 @@ class RentApiView(generics.CreateAPIView):
         bike_id = self.kwargs.get("bike_id")  # Получаем ID велосипеда из URL
 
         try:
-            bike = Bicycle.objects.get(id=bike_id)
+            with transaction.atomic():
+                # Блокируем строку велосипеда до конца транзакции, чтобы параллельные
+                # запросы не могли арендовать один и тот же велосипед
+                bike = Bicycle.objects.select_for_update(no_key=True).get(id=bike_id)
 
-            # Проверка, доступен ли велосипед для аренды
-            if bike.is_rented:
-                logging.warning(f"{bike} with bike id {bike_id} is already rented.")
-                raise serializers.ValidationError("Bicycle is not available.")
+                # Проверка, доступен ли велосипед для аренды
+                if bike.is_rented:
+                    logging.warning(f"{bike} with bike id {bike_id} is already rented.")
+                    raise serializers.ValidationError("Bicycle is not available.")
 
-            # Проверка, нет ли у пользователя активной аренды
-            active_rentals = Rental.objects.filter(renter=self.request.user).filter(
-                status="active"
-            )
-            if active_rentals.exists():
-                logging.warning(f"{self.request.user} has an active rental.")
-                raise serializers.ValidationError("User already has an active rental.")
-
-            serializer.save(rented_bike=bike, renter=self.request.user, status="active")
+                # Наличие активной аренды у пользователя проверяет ограничение
+                # unique_active_rental_per_renter при вставке записи
+                serializer.save(rented_bike=bike, renter=self.request.user, status="active")
 
-            # Изменение статуса велосипеда
-            bike.is_rented = True
-            bike.save()
+                # Изменение статуса велосипеда
+                bike.is_rented = True
+                bike.save(update_fields=["is_rented"])
 
-            # Логирование начала аренды
-            logging.info(f"{self.request.user} started rental {bike} with bike id {bike_id}.")
+                # Обновление индекса доступных велосипедов после фиксации транзакции
+                transaction.on_commit(lambda: refresh_bike_availability(bike.pk))
 
         except ObjectDoesNotExist:
             logging.warning(f"Bicycle with id {bike_id} not found.")
             raise serializers.ValidationError("Bicycle not found.")
 
+        except IntegrityError as e:
+            if "unique_active_rental_per_renter" not in str(e):
+                raise
+            logging.warning(f"{self.request.user} has an active rental.")
+            raise serializers.ValidationError("User already has an active rental.")
+
+        # Логирование начала аренды
+        logging.info(f"{self.request.user} started rental {bike} with bike id {bike_id}.")
 
-class RentListApiView(generics.ListAPIView):
-    """API эндпоинт для просмотра всех записей об аренде велосипеда."""
+
+class RentListApiView(ReplicaReadMixin, SparseFieldsMixin, generics.ListAPIView):
+    """API эндпоинт для просмотра всех записей об аренде велосипеда. Поддерживает выборочные поля (?fields=)."""
 
     serializer_class = RentSerializer
-    queryset = Rental.objects.all()
+    queryset = Rental.objects.select_related("renter", "rented_bike")
+    permission_classes = (IsAuthenticated, IsModerator)
+    pagination_class = RentalPaginator
+
+
+class RentExportView(ExportAPIView):
+    """API эндпоинт для потоковой выгрузки всех аренд в csv или ndjson."""
+
     permission_classes = (IsAuthenticated, IsModerator)
+    export_columns = RENTAL_COLUMNS
+    export_name = "rentals"
+
+    def get_queryset(self):
+        return rental_export_queryset()
 
 
 class RentRetrieveApiView(generics.RetrieveAPIView):
     """API эндпоинт для просмотра одной записи об аренде велосипеда."""
 
     serializer_class = RentSerializer
-    queryset = Rental.objects.all()
+    queryset = Rental.objects.select_related("renter", "rented_bike")
 
     def get_object(self, queryset=None):
         rental_id = self.kwargs.get('pk')
-        return get_object_or_404(Rental, pk=rental_id)
+        return get_object_or_404(self.get_queryset(), pk=rental_id)
 
     def retrieve(self, request, *args, **kwargs):
         """ Просмотр записи об аренде доступен только арендатору, модератору и суперпользователю."""
 
         rental = self.get_object()
         if rental.renter == request.user or request.user.is_staff or request.user.is_superuser:
-            result = super().retrieve(request, *args, **kwargs)
+            result = Response(self.get_serializer(rental).data)
         else:
             return Response({"detail": "You do not have permission to view this rental"}, status=403)
         return result
@@ -89,7 +113,7 @@ class RentRetrieveApiView(generics.RetrieveAPIView):
 class ReturnView(generics.UpdateAPIView):
     """API эндпоинт для обновления записи об аренде велосипеда - возврат велосипеда."""
 
-    queryset = Rental.objects.all()
+    queryset = Rental.objects.select_related("renter", "rented_bike")
     serializer_class = RentSerializer
     permission_classes = (IsAuthenticated,)
 
@@ -112,33 +136,26 @@ class ReturnView(generics.UpdateAPIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Обновление статуса аренды
-        instance.status = "pending"
-        instance.end_time = now()
-        instance.save()
-
-        logging.info(f"Rental {instance.pk} is completed and payment is pending.")
-
-        # Фоновая задача расчёта платы за аренду
-        payment_task = get_rental_cost.delay(instance.pk)
-        payment_task.get()
+        # Обновление статуса аренды и освобождение велосипеда одной транзакцией
+        with transaction.atomic():
+            instance.status = "pending"
+            instance.end_time = now()
+            instance.pricing_status = "calculating"
+            # Если задача расчёта потеряется, расчёт повторит retry_rental_costs
+            instance.pricing_next_attempt_at = instance.end_time + PRICING_TIMEOUT
+            instance.save(update_fields=["status", "end_time", "pricing_status", "pricing_next_attempt_at"])
 
-        result = payment_task.result
+            if instance.rented_bike_id is not None:
+                bike_id = instance.rented_bike_id
+                Bicycle.objects.filter(id=bike_id).update(is_rented=False)
+                transaction.on_commit(lambda: refresh_bike_availability(bike_id))
 
-        if result and result.get('status') == 'success':
-            rental_cost = Decimal(result['rental_cost'])
-            instance.rental_cost = rental_cost
-            instance.save()
+            # Фоновая задача расчёта платы за аренду запускается после фиксации транзакции,
+            # ответ клиенту не ждёт её завершения
+            transaction.on_commit(lambda: get_rental_cost.delay(instance.pk))
 
-            logging.info(f"Payment for rental {instance.pk} is successfully calculated.")
-        else:
-            raise ValueError(f"Ошибка при расчете стоимости аренды: {result}")
+        logging.info(f"Rental {instance.pk} is completed and payment is pending.")
 
-        # Изменение статуса велосипеда
-        bike_id = instance.rented_bike.id  # Получаем ID велосипеда
-        bike = Bicycle.objects.get(id=bike_id)
-        bike.is_rented = False
-        bike.save()
         return Response(
             self.serializer_class(instance).data, status=status.HTTP_200_OK
         )
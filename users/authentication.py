@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+from users.permissions import is_moderator
+
+# Состояние пользователя из бд (данные и права) хранится в кэше недолго: запись сбрасывается
+# при изменении пользователя или его групп, срок хранения ограничивает устаревание записи,
+# сохранённой параллельным запросом до фиксации изменения
+USER_STATE_TIMEOUT = 60
+# Отозванные пользователи хранятся, пока действуют выданные им токены
+REVOKED_TIMEOUT = int(settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"].total_seconds())
+
+
+def user_state_cache_key(user_id):
+    return f"users:state:{user_id}"
+
+
+def revoked_cache_key(user_id):
+    return f"users:revoked:{user_id}"
+
+
+def get_user_state(user):
+    """Возвращает данные и права пользователя для кэша."""
+    return {
+        "email": user.email,
+        "is_staff": user.is_staff,
+        "is_superuser": user.is_superuser,
+        "is_moderator": is_moderator(user),
+    }
+
+
+def invalidate_user_states(user_ids):
+    """Сбрасывает состояние пользователей в кэше: следующий запрос загрузит его из бд."""
+    cache.delete_many([user_state_cache_key(user_id) for user_id in user_ids])
+
+
+def revoke_user(user_id):
+    """Добавляет пользователя в список отозванных: все его токены отклоняются без запроса к бд."""
+    cache.set(revoked_cache_key(user_id), True, REVOKED_TIMEOUT)
+
+
+def restore_user(user_id):
+    cache.delete(revoked_cache_key(user_id))
+
+
+def is_revoked(user_id):
+    return bool(cache.get(revoked_cache_key(user_id)))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Аутентификация по JWT без запроса к таблице пользователей на чтение.
+
+    Из токена берётся только id пользователя. Для безопасных методов (GET, HEAD, OPTIONS)
+    данные и права пользователя читаются из кэша состояния, а при его отсутствии пользователь
+    загружается из бд и состояние кэшируется на USER_STATE_TIMEOUT. Изменяющие запросы всегда
+    загружают пользователя из бд. Токены отозванных пользователей отклоняются без обращения к бд;
+    отсутствие записи в списке отозванных ничего не разрешает - неактивный пользователь,
+    которого нет в кэше состояния, отклоняется при загрузке из бд.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if request.method in SAFE_METHODS:
+            return self.get_cached_user(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def get_user(self, validated_token):
+        if is_revoked(self.get_user_id(validated_token)):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return super().get_user(validated_token)
+
+    def get_cached_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        if is_revoked(user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        state = cache.get(user_state_cache_key(user_id))
+        if state is None:
+            # Неактивный или удалённый пользователь отклоняется здесь и в кэш не попадает
+            user = self.get_user(validated_token)
+            cache.set(user_state_cache_key(user_id), get_user_state(user), USER_STATE_TIMEOUT)
+            return user
+
+        user = User(
+            id=user_id,
+            email=state["email"],
+            is_staff=state["is_staff"],
+            is_superuser=state["is_superuser"],
+            is_active=True,
+        )
+        user._state.adding = False
+        user._is_moderator = state["is_moderator"]
+        return user
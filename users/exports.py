@@ -0,0 +1,17 @@
+from users.models import Payment
+
+# Колонки выгрузки платежей: название колонки - путь к полю для values_list
+PAYMENT_COLUMNS = {
+    "id": "id",
+    "user": "user__email",
+    "rental": "rental_id",
+    "date": "date",
+    "amount": "amount",
+    "method": "method",
+    "status": "status",
+    "session_id": "session_id",
+}
+
+
+def payment_export_queryset():
+    return Payment.objects.order_by("id")
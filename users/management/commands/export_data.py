@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand, CommandError
+
+from config.exports import EXPORT_FORMATS, stream_export
+from rents.exports import RENTAL_COLUMNS, rental_export_queryset
+from users.exports import PAYMENT_COLUMNS, payment_export_queryset
+from users.filters import PaymentFilterSet
+
+
+class Command(BaseCommand):
+    """
+    Custom management command to export rentals or payments as CSV or NDJSON.
+    python manage.py export_data rentals|payments [--format csv|ndjson] [--output FILE]
+        [--method cash|transfer] [--bike-brand BRAND]
+
+    Rows are read with a server-side cursor and written in chunks, so memory usage does
+    not depend on the size of the table. Payment exports accept the same filters as the
+    payment history endpoint (PaymentFilterSet).
+    """
+
+    help = "Stream rentals or payments to a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=["rentals", "payments"], help="What to export")
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", help="Output format")
+        parser.add_argument("--output", help="Write to this file instead of stdout")
+        parser.add_argument("--method", help="Payments only: filter by payment method")
+        parser.add_argument("--bike-brand", help="Payments only: filter by bike brand (icontains)")
+
+    def handle(self, *args, **options):
+        if options["model"] == "rentals":
+            queryset, columns = rental_export_queryset(), RENTAL_COLUMNS
+        else:
+            filters = {"method": options["method"], "bike_brand": options["bike_brand"]}
+            filterset = PaymentFilterSet(
+                {name: value for name, value in filters.items() if value}, queryset=payment_export_queryset()
+            )
+            if not filterset.is_valid():
+                raise CommandError(f"Invalid filters: {filterset.errors.as_text()}")
+            queryset, columns = filterset.qs, PAYMENT_COLUMNS
+
+        chunks = (
+            chunk if isinstance(chunk, str) else chunk.decode()
+            for chunk in stream_export(queryset, columns, options["format"])
+        )
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,354 @@
+import io
+import math
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+
+from bikes.models import Bicycle
+from bikes.response_cache import invalidate_bike_responses
+from bikes.services import invalidate_availability_index
+from rents.models import Rental
+from rents.utils import CENT, calculate_rental_costs_cents
+from users.models import Payment, User
+
+SEED_EMAIL_DOMAIN = "seed.bike-rental.test"
+
+BRANDS = [
+    "Stels", "Forward", "Stern", "Merida", "Trek", "Giant", "Cube", "Author",
+    "Format", "Scott", "Specialized", "Cannondale", "Kona", "Bianchi", "Orbea", "Novatrack",
+]
+COLOURS = ["black", "white", "red", "blue", "green", "grey", "yellow", "orange", None]
+FIRST_NAMES = ["Anna", "Ivan", "Maria", "Petr", "Olga", "Sergey", "Elena", "Dmitry", "Irina", "Alexey"]
+LAST_NAMES = ["Ivanov", "Petrova", "Sidorov", "Smirnova", "Kuznetsov", "Popova", "Volkov", "Sokolova"]
+WHEEL_SIZES = {"A": [26, 27, 28, 29], "J": [24, 26], "K": [16, 18, 20]}
+HOUR_TARIFFS = [Decimal(value) for value in ("2.50", "3.00", "4.00", "5.00", "7.50", "10.00")]
+
+
+def _weights(value, choices):
+    """Разбирает веса распределения вида 'A=6,J=2,K=2'."""
+    weights = dict(item.split("=") for item in value.split(","))
+    unknown = set(weights) - {code for code, _ in choices}
+    if unknown:
+        raise CommandError(f"Unknown choices in distribution: {', '.join(sorted(unknown))}")
+    return list(weights), [float(weight) for weight in weights.values()]
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class Command(BaseCommand):
+    """
+    Custom management command to generate a large seeded dataset for load and performance testing.
+    python manage.py generate_dataset --bikes 100000 --users 1000000 --rentals 10000000
+
+    Bikes, users, rentals and payments are generated in batches and loaded with PostgreSQL COPY,
+    so memory usage does not depend on the dataset size. Every batch is committed separately
+    (a rental batch together with its payments), so a long run does not hold one huge transaction.
+    Primary keys are assigned explicitly after the current maximum and the identity sequences
+    are moved forward once at the end, also when the run fails.
+    The same --seed with the same options produces the same data.
+
+    Generated users get emails in the SEED_EMAIL_DOMAIN domain and share one password
+    (--password); --clear removes all bikes, rentals, payments and previously generated users.
+    """
+
+    help = "Generate a large dataset of bikes, users, rentals and payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bikes", type=int, default=100_000)
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--rentals", type=int, default=10_000_000)
+        parser.add_argument("--seed", type=int, default=42, help="Random seed")
+        parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per COPY batch")
+        parser.add_argument("--days", type=int, default=365, help="History length in days")
+        parser.add_argument("--type-weights", default="A=6,J=2,K=2", help="Bike type distribution")
+        parser.add_argument("--condition-weights", default="E=3,G=5,S=2", help="Bike condition distribution")
+        parser.add_argument("--rental-hours-median", type=float, default=2.0,
+                            help="Median rental duration in hours (log-normal)")
+        parser.add_argument("--rental-hours-sigma", type=float, default=1.0,
+                            help="Sigma of the log-normal rental duration")
+        parser.add_argument("--user-activity-skew", type=float, default=2.0,
+                            help="1 spreads rentals evenly over users, higher values concentrate them")
+        parser.add_argument("--active-ratio", type=float, default=0.3,
+                            help="Share of bikes that are currently rented")
+        parser.add_argument("--pending-ratio", type=float, default=0.02,
+                            help="Share of finished rentals that are not paid yet")
+        parser.add_argument("--cash-ratio", type=float, default=0.2, help="Share of payments made in cash")
+        parser.add_argument("--password", default="password", help="Password for all generated users")
+        parser.add_argument("--clear", action="store_true", help="Remove existing data before generating")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("generate_dataset requires PostgreSQL (COPY).")
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = now().replace(microsecond=0)
+        started = time.monotonic()
+
+        try:
+            if options["clear"]:
+                self.clear()
+
+            bikes = self.generate_bikes(options)
+            users = self.generate_users(options)
+            self.generate_rentals(options, bikes, users)
+        finally:
+            self.reset_sequences()
+
+        with connection.cursor() as cursor:
+            for model in (Bicycle, User, Rental, Payment):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+        # COPY не вызывает сигналы моделей, поэтому индекс и кэш ответов сбрасываются явно
+        invalidate_availability_index()
+        invalidate_bike_responses()
+
+        self.stdout.write(self.style.SUCCESS(f"Dataset generated in {time.monotonic() - started:.1f}s"))
+
+    def clear(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"TRUNCATE {Payment._meta.db_table}, {Rental._meta.db_table}, {Bicycle._meta.db_table}"
+            )
+            cursor.execute(f"DELETE FROM {User._meta.db_table} WHERE email LIKE %s", [f"%@{SEED_EMAIL_DOMAIN}"])
+        self.stdout.write("Existing data removed.")
+
+    def copy(self, model, fields, rows):
+        """Загружает строки в таблицу модели через COPY пакетами по batch_size строк."""
+        table = model._meta.db_table
+        columns = ", ".join(model._meta.get_field(field).column for field in fields)
+        count = 0
+        with connection.cursor() as cursor:
+            while True:
+                buffer = io.StringIO()
+                batch = 0
+                for row in rows:
+                    buffer.write("\t".join(map(_copy_value, row)))
+                    buffer.write("\n")
+                    batch += 1
+                    if batch == self.batch_size:
+                        break
+                if not batch:
+                    break
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+                count += batch
+        return count
+
+    def reset_sequences(self):
+        """Переводит последовательности id за максимальные id, назначенные при загрузке."""
+        with connection.cursor() as cursor:
+            for model in (Bicycle, User, Rental, Payment):
+                table = model._meta.db_table
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"
+                )
+
+    def report(self, name, count, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{name}: {count} rows in {elapsed:.1f}s ({count / (elapsed or 1):.0f} rows/s)")
+
+    def next_id(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {model._meta.db_table}")
+            return cursor.fetchone()[0]
+
+    def generate_bikes(self, options):
+        """Создаёт велосипеды, возвращает список (id, тариф за час, тариф за сутки)."""
+        types, type_weights = _weights(options["type_weights"], Bicycle.TYPE_CHOICES)
+        conditions, condition_weights = _weights(options["condition_weights"], Bicycle.CONDITION_CHOICES)
+        frame_types = [code for code, _ in Bicycle.FRAME_TYPE_CHOICES]
+        # Популярные бренды встречаются чаще (распределение Ципфа)
+        brand_weights = [1 / rank for rank in range(1, len(BRANDS) + 1)]
+
+        started = time.monotonic()
+        first_id = self.next_id(Bicycle)
+        count = options["bikes"]
+        rng = self.rng
+        bikes = []
+
+        def rows():
+            for bike_id in range(first_id, first_id + count):
+                bike_type = rng.choices(types, type_weights)[0]
+                cost_hour = rng.choice(HOUR_TARIFFS)
+                cost_day = cost_hour * rng.choice([5, 6, 8])
+                bikes.append((bike_id, cost_hour, cost_day))
+                yield (
+                    bike_id,
+                    rng.choices(BRANDS, brand_weights)[0],
+                    rng.choices(conditions, condition_weights)[0],
+                    bike_type,
+                    rng.choice([1, 3, 7, 18, 21, 24]),
+                    rng.choice(frame_types),
+                    rng.choice(WHEEL_SIZES.get(bike_type, [26])),
+                    rng.choice(COLOURS),
+                    None,
+                    cost_hour,
+                    cost_day,
+                    False,
+                )
+
+        self.copy(
+            Bicycle,
+            ["id", "brand", "condition", "type", "gear_count", "frame_type", "wheel_size", "colour", "image",
+             "rental_cost_hour", "rental_cost_day", "is_rented"],
+            rows(),
+        )
+        self.report("Bikes", count, started)
+        return bikes
+
+    def generate_users(self, options):
+        """Создаёт пользователей, возвращает диапазон их id."""
+        started = time.monotonic()
+        password = make_password(options["password"])  # один хэш на всех пользователей
+        first_id = self.next_id(User)
+        count = options["users"]
+        rng = self.rng
+        joined_from = self.now - timedelta(days=options["days"])
+
+        def rows():
+            for user_id in range(first_id, first_id + count):
+                yield (
+                    user_id,
+                    password,
+                    None,
+                    False,
+                    False,
+                    True,
+                    joined_from + timedelta(seconds=rng.randrange(options["days"] * 86400 or 1)),
+                    f"user{user_id}@{SEED_EMAIL_DOMAIN}",
+                    rng.choice(FIRST_NAMES),
+                    rng.choice(LAST_NAMES),
+                )
+
+        self.copy(
+            User,
+            ["id", "password", "last_login", "is_superuser", "is_staff", "is_active", "date_joined", "email",
+             "first_name", "last_name"],
+            rows(),
+        )
+        self.report("Users", count, started)
+        return range(first_id, first_id + count)
+
+    def generate_rentals(self, options, bikes, users):
+        """
+        Создаёт историю аренд и платежи к оплаченным арендам.
+
+        Часть велосипедов находится в активной аренде: у каждой такой аренды свой велосипед
+        и свой пользователь без другой активной аренды, как того требует ограничение
+        unique_active_rental_per_renter.
+        """
+        if not bikes or not users:
+            return
+
+        started = time.monotonic()
+        rng = self.rng
+        count = options["rentals"]
+        free_renters = list(
+            User.objects.filter(id__gte=users.start, id__lt=users.stop)
+            .exclude(Exists(Rental.objects.filter(renter=OuterRef("pk"), status="active")))
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        active_count = min(int(len(bikes) * options["active_ratio"]), len(free_renters), count)
+        history_count = count - active_count
+        history_start = self.now - timedelta(days=options["days"])
+        history_seconds = max(options["days"] * 86400 - 86400, 1)
+        mu = math.log(options["rental_hours_median"] * 3600)
+        sigma = options["rental_hours_sigma"]
+        skew = options["user_activity_skew"]
+        user_count = len(users)
+
+        first_rental_id = self.next_id(Rental)
+        first_payment_id = self.next_id(Payment)
+        payments = []  # (id аренды, пользователь, сумма, дата окончания) для платежей текущего пакета
+
+        def pick_user():
+            # При skew > 1 небольшая часть пользователей совершает большую часть аренд
+            return users[int(user_count * rng.random() ** skew)]
+
+        def history_rows():
+            rental_id = first_rental_id
+            for offset in range(0, history_count, self.batch_size):
+                size = min(self.batch_size, history_count - offset)
+                batch_bikes = [bikes[rng.randrange(len(bikes))] for _ in range(size)]
+                starts = [history_start + timedelta(seconds=rng.randrange(history_seconds)) for _ in range(size)]
+                ends = [
+                    start + timedelta(seconds=max(int(rng.lognormvariate(mu, sigma)), 60))
+                    for start in starts
+                ]
+                costs = calculate_rental_costs_cents(
+                    starts, ends, [bike[1] for bike in batch_bikes], [bike[2] for bike in batch_bikes]
+                )
+                for bike, start, end, cents in zip(batch_bikes, starts, ends, costs):
+                    renter = pick_user()
+                    cost = Decimal(cents) * CENT
+                    status = "pending" if rng.random() < options["pending_ratio"] else "completed"
+                    if status == "completed":
+                        payments.append((rental_id, renter, cost, end))
+                    yield rental_id, start, end, bike[0], renter, status, cost, "calculated", 0
+                    rental_id += 1
+
+            # Активные аренды: уникальные велосипеды и пользователи
+            for bike, renter in zip(rng.sample(bikes, active_count), rng.sample(free_renters, active_count)):
+                start = self.now - timedelta(seconds=rng.randrange(1, 6 * 3600))
+                yield rental_id, start, None, bike[0], renter, "active", Decimal("0.00"), "not_calculated", 0
+                rental_id += 1
+
+        fields = [
+            "id", "start_time", "end_time", "rented_bike", "renter", "status", "rental_cost", "pricing_status",
+            "pricing_attempts",
+        ]
+        payment_fields = [
+            "id", "user", "date", "rental", "amount", "method", "session_id", "status", "checkout_status",
+            "checkout_attempts",
+        ]
+        payment_id = first_payment_id
+
+        # Аренды и платежи загружаются поочерёдно, чтобы список платежей не рос вместе с историей
+        rows = history_rows()
+        while True:
+            batch = [row for _, row in zip(range(self.batch_size), rows)]
+            if not batch:
+                break
+
+            payment_rows = []
+            for rental_id, renter, amount, end in payments:
+                if rng.random() < options["cash_ratio"]:
+                    method, session_id, checkout_status = "cash", None, "not_required"
+                else:
+                    method, session_id, checkout_status = "transfer", f"cs_seed_{payment_id}", "created"
+                payment_rows.append(
+                    (payment_id, renter, end + timedelta(minutes=rng.randint(1, 30)), rental_id, amount, method,
+                     session_id, "paid", checkout_status, int(method == "transfer"))
+                )
+                payment_id += 1
+            payments.clear()
+
+            # Пакет аренд фиксируется вместе с платежами к ним
+            with transaction.atomic():
+                self.copy(Rental, fields, iter(batch))
+                if payment_rows:
+                    self.copy(Payment, payment_fields, iter(payment_rows))
+
+        active_bikes = Rental.objects.filter(id__gte=first_rental_id, status="active").values("rented_bike")
+        Bicycle.objects.filter(id__in=active_bikes).update(is_rented=True)
+        self.report(f"Rentals ({active_count} active) and payments", count + payment_id - first_payment_id, started)
@@ -0,0 +1,402 @@
+import json
+import logging
+import platform
+import statistics
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from bikes.models import Bicycle
+from bikes.response_cache import invalidate_bike_responses
+from bikes.serializers import BikeSerializer
+from bikes.services import invalidate_availability_index
+from config.renderers import ORJSONRenderer
+from rents.models import Rental
+from rents.utils import calculate_rental_cost, calculate_rental_costs
+from users.models import Payment, User
+
+
+class SkipBenchmark(Exception):
+    """Для сценария нет подходящих данных."""
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+@contextmanager
+def _rollback():
+    """Выполняет блок в точке сохранения и откатывает изменения, чтобы итерации не влияли друг на друга."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def _run_on_commit():
+    """
+    Выполняет колбэки on_commit, добавленные в блоке, сразу после него.
+
+    Замеры выполняются в откатываемой транзакции, которая не фиксируется, поэтому работа
+    после фиксации (обновление индекса, сброс кэша, расчёт стоимости) иначе не выполнялась бы.
+    """
+    start = len(connection.run_on_commit)
+    yield
+    while len(connection.run_on_commit) > start:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback, _ in callbacks:
+            callback()
+
+
+class Command(BaseCommand):
+    """
+    Custom management command to benchmark the API hot paths.
+    python manage.py run_benchmarks --output bench.json [--baseline previous.json]
+
+    Run it against a seeded database (see generate_dataset). Each scenario is executed
+    through the Django test client with forced authentication; latency percentiles,
+    queries per request and peak allocated memory per request (tracemalloc, in a separate
+    pass) are written to JSON. Everything runs in a transaction that is rolled back, so
+    rent and return scenarios do not change the data; their on_commit callbacks (index refresh,
+    cache invalidation and, with Celery tasks executed eagerly, cost calculation) run right after
+    the request and are measured with it.
+
+    The cache is used with a key prefix unique to the run, so the benchmarks start with an empty
+    cache and neither read nor invalidate the entries of the running application.
+
+    The json_render_* scenarios compare JSON encoding of 1,000 serialized bikes with
+    the stdlib-based JSONRenderer and the orjson-based ORJSONRenderer.
+
+    The db_connection_* scenarios compare opening a new database connection per request
+    (CONN_MAX_AGE=0) with reusing a persistent, health-checked connection.
+
+    With --baseline the results are compared to a previous run and the command fails if
+    a scenario's p50 latency grows by more than --tolerance or it makes more queries.
+    """
+
+    help = "Benchmark API hot paths and pricing against the current database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200, help="Measured iterations per scenario")
+        parser.add_argument("--warmup", type=int, default=10, help="Unmeasured iterations per scenario")
+        parser.add_argument("--alloc-iterations", type=int, default=20,
+                            help="Iterations traced with tracemalloc")
+        parser.add_argument("--pricing-batch", type=int, default=10_000, help="Rentals priced per pricing run")
+        parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+        parser.add_argument("--output", help="Write results to this JSON file")
+        parser.add_argument("--baseline", help="Compare with results from this JSON file")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed relative p50 latency growth against the baseline")
+
+    def handle(self, *args, **options):
+        self.options = options
+        host = next((h.lstrip(".") for h in settings.ALLOWED_HOSTS if h and h != "*"), "localhost")
+        self.client = APIClient(HTTP_HOST=host)
+
+        scenarios = {
+            "available_bikes": self.bench_available_bikes,
+            "available_bikes_filtered": self.bench_available_bikes_filtered,
+            "available_bikes_cold": self.bench_available_bikes_cold,
+            "rent_bike": self.bench_rent_bike,
+            "return_bike": self.bench_return_bike,
+            "user_rent_history": self.bench_user_rent_history,
+            "payment_list_user": self.bench_payment_list_user,
+            "payment_list_moderator": self.bench_payment_list_moderator,
+            "pricing_single": self.bench_pricing_single,
+            "pricing_batch": self.bench_pricing_batch,
+            "json_render_stdlib": self.bench_json_render_stdlib,
+            "json_render_orjson": self.bench_json_render_orjson,
+            "db_connection_new": self.bench_db_connection_new,
+            "db_connection_persistent": self.bench_db_connection_persistent,
+        }
+        if options["only"]:
+            unknown = set(options["only"]) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+            scenarios = {name: scenarios[name] for name in options["only"]}
+
+        results = {}
+        caches = {
+            alias: {**config, "KEY_PREFIX": f"{config.get('KEY_PREFIX', '')}:benchmark:{uuid.uuid4().hex}"}
+            for alias, config in settings.CACHES.items()
+        }
+        logging.disable(logging.WARNING)
+        try:
+            with override_settings(CACHES=caches, CELERY_TASK_ALWAYS_EAGER=True), _rollback():
+                for name, scenario in scenarios.items():
+                    try:
+                        results[name] = scenario()
+                    except SkipBenchmark as e:
+                        self.stdout.write(self.style.WARNING(f"{name}: skipped ({e})"))
+                        continue
+                    self.stdout.write(self.format_result(name, results[name]))
+        finally:
+            logging.disable(logging.NOTSET)
+
+        report = {
+            "meta": {
+                "created": now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "rentals": Rental.objects.count(),
+                "bikes": Bicycle.objects.count(),
+                "iterations": options["iterations"],
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results are written to {options['output']}")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    # Измерение
+
+    def measure(self, request, prepare=None, rollback=False, units=1, scale=1):
+        """
+        Измеряет сценарий: задержки по итерациям, запросы к бд и память на одну итерацию.
+
+        prepare() выполняется перед каждой итерацией вне замера и возвращает аргументы для request().
+        Колбэки on_commit, добавленные request(), выполняются в замере.
+        scale уменьшает количество итераций для медленных сценариев.
+        """
+        options = self.options
+
+        def iteration():
+            args = prepare() if prepare else ()
+            with _rollback() if rollback else nullcontext():
+                started = time.perf_counter()
+                with _run_on_commit():
+                    response = request(*args)
+                elapsed = time.perf_counter() - started
+            status_code = getattr(response, "status_code", 200)
+            if status_code >= 400:
+                raise CommandError(f"Unexpected response {status_code}: {getattr(response, 'data', '')}")
+            return elapsed
+
+        for _ in range(max(int(options["warmup"] * scale), 1)):
+            iteration()
+
+        latencies = [iteration() for _ in range(max(int(options["iterations"] * scale), 1))]
+
+        with CaptureQueriesContext(connection) as queries:
+            iteration()
+        query_count = len(queries)
+
+        allocations = []
+        tracemalloc.start()
+        try:
+            for _ in range(max(int(options["alloc_iterations"] * scale), 1)):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                iteration()
+                allocations.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "iterations": len(latencies),
+            "units_per_iteration": units,
+            "latency_ms": {
+                "min": min(latencies) * 1000,
+                "mean": statistics.fmean(latencies) * 1000,
+                "p50": _percentile(latencies, 50) * 1000,
+                "p90": _percentile(latencies, 90) * 1000,
+                "p99": _percentile(latencies, 99) * 1000,
+                "max": max(latencies) * 1000,
+            },
+            "queries": query_count,
+            "peak_alloc_kb": statistics.median(allocations) / 1024 if allocations else None,
+        }
+
+    def format_result(self, name, result):
+        latency = result["latency_ms"]
+        return (
+            f"{name:<26} p50 {latency['p50']:8.2f} ms  p90 {latency['p90']:8.2f} ms  "
+            f"p99 {latency['p99']:8.2f} ms  queries {result['queries']:3d}  "
+            f"alloc {result['peak_alloc_kb'] or 0:9.1f} KiB"
+        )
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as file:
+            baseline = json.load(file)["results"]
+
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            p50, previous_p50 = result["latency_ms"]["p50"], previous["latency_ms"]["p50"]
+            change = (p50 - previous_p50) / previous_p50 if previous_p50 else 0
+            self.stdout.write(f"{name:<26} p50 {previous_p50:8.2f} -> {p50:8.2f} ms ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(f"{name}: p50 {previous_p50:.2f} -> {p50:.2f} ms")
+            if result["queries"] > previous["queries"]:
+                regressions.append(f"{name}: queries {previous['queries']} -> {result['queries']}")
+
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    # Сценарии
+
+    def regular_user(self):
+        user = User.objects.filter(is_staff=False, is_superuser=False).first()
+        if user is None:
+            raise SkipBenchmark("no users")
+        return user
+
+    def bench_available_bikes(self):
+        self.client.force_authenticate(user=self.regular_user())
+        url = reverse("bikes:available-bikes")
+        return self.measure(lambda: self.client.get(url))
+
+    def bench_available_bikes_filtered(self):
+        self.client.force_authenticate(user=self.regular_user())
+        bike = Bicycle.objects.filter(is_rented=False).first()
+        if bike is None:
+            raise SkipBenchmark("no available bikes")
+        url = reverse("bikes:available-bikes")
+        params = {"type": bike.type, "condition": bike.condition, "brand__icontains": bike.brand[1:4]}
+        return self.measure(lambda: self.client.get(url, params))
+
+    def bench_available_bikes_cold(self):
+        self.client.force_authenticate(user=self.regular_user())
+        url = reverse("bikes:available-bikes")
+
+        def prepare():
+            invalidate_availability_index()
+            invalidate_bike_responses()
+            return ()
+
+        return self.measure(lambda: self.client.get(url), prepare=prepare, scale=0.1)
+
+    def bench_rent_bike(self):
+        renter = User.objects.exclude(rents__status="active").first()
+        bike = Bicycle.objects.filter(is_rented=False).first()
+        if renter is None or bike is None:
+            raise SkipBenchmark("no free user or available bike")
+        self.client.force_authenticate(user=renter)
+        url = reverse("rents:rent-bike", kwargs={"bike_id": bike.pk})
+        return self.measure(lambda: self.client.post(url), rollback=True)
+
+    def bench_return_bike(self):
+        rental = Rental.objects.filter(status="active", rented_bike__isnull=False).select_related("renter").first()
+        if rental is None:
+            raise SkipBenchmark("no active rentals")
+        self.client.force_authenticate(user=rental.renter)
+        url = reverse("rents:return-bike", kwargs={"pk": rental.pk})
+        return self.measure(lambda: self.client.patch(url), rollback=True)
+
+    def bench_user_rent_history(self):
+        # Пользователь с самой длинной историей аренды
+        user = User.objects.annotate(rentals_count=Count("rents")).order_by("-rentals_count").first()
+        if user is None:
+            raise SkipBenchmark("no users")
+        self.client.force_authenticate(user=user)
+        url = reverse("users:user-history")
+        return self.measure(lambda: self.client.get(url))
+
+    def bench_payment_list_user(self):
+        payment = Payment.objects.select_related("user").first()
+        if payment is None:
+            raise SkipBenchmark("no payments")
+        self.client.force_authenticate(user=payment.user)
+        url = reverse("users:payments-history")
+        return self.measure(lambda: self.client.get(url))
+
+    def bench_payment_list_moderator(self):
+        if not Payment.objects.exists():
+            raise SkipBenchmark("no payments")
+        moderator = User.objects.create(email="benchmark-moderator@example.com")
+        moderator.groups.add(Group.objects.get_or_create(name="moderators")[0])
+        self.client.force_authenticate(user=moderator)
+        url = reverse("users:payments-history")
+        return self.measure(lambda: self.client.get(url))
+
+    def pricing_rentals(self):
+        rentals = list(
+            Rental.objects.filter(end_time__isnull=False, rented_bike__isnull=False)
+            .select_related("rented_bike")[:self.options["pricing_batch"]]
+        )
+        if not rentals:
+            raise SkipBenchmark("no finished rentals")
+        for rental in rentals:
+            rental.status = "pending"
+        return rentals
+
+    def bench_pricing_single(self):
+        rentals = self.pricing_rentals()
+        return self.measure(
+            lambda: [calculate_rental_cost(rental) for rental in rentals], units=len(rentals), scale=0.25
+        )
+
+    def bench_pricing_batch(self):
+        rentals = self.pricing_rentals()
+        columns = (
+            [rental.start_time for rental in rentals],
+            [rental.end_time for rental in rentals],
+            [rental.rented_bike.rental_cost_hour for rental in rentals],
+            [rental.rented_bike.rental_cost_day for rental in rentals],
+        )
+        return self.measure(lambda: calculate_rental_costs(*columns), units=len(rentals), scale=0.25)
+
+    def bench_json_render(self, renderer):
+        """Кодирование в JSON списка из 1000 велосипедов, сериализованного один раз вне замера."""
+        bikes = list(Bicycle.objects.order_by("id")[:1000])
+        if not bikes:
+            raise SkipBenchmark("no bikes")
+        data = BikeSerializer(bikes, many=True).data
+        return self.measure(lambda: renderer.render(data, "application/json"), units=len(bikes))
+
+    def bench_json_render_stdlib(self):
+        return self.bench_json_render(JSONRenderer())
+
+    def bench_json_render_orjson(self):
+        return self.bench_json_render(ORJSONRenderer())
+
+    def bench_db_connection(self, conn_max_age):
+        """
+        Цикл запроса к бд на отдельном соединении: проверка соединения в начале и в конце запроса,
+        как при сигналах request_started и request_finished, и один запрос.
+        """
+        default = connections[DEFAULT_DB_ALIAS]
+        db = type(default)(
+            {**default.settings_dict, "CONN_MAX_AGE": conn_max_age, "CONN_HEALTH_CHECKS": True}, DEFAULT_DB_ALIAS
+        )
+
+        def request():
+            db.close_if_unusable_or_obsolete()
+            with db.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            db.close_if_unusable_or_obsolete()
+
+        try:
+            return self.measure(request)
+        finally:
+            db.close()
+
+    def bench_db_connection_new(self):
+        return self.bench_db_connection(conn_max_age=0)
+
+    def bench_db_connection_persistent(self):
+        return self.bench_db_connection(conn_max_age=settings.DATABASES["default"]["CONN_MAX_AGE"] or 60)
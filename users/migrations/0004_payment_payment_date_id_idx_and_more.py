@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rents", "0009_rental_rental_start_time_id_idx_and_more"),
+        ("users", "0003_alter_payment_options"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["-date", "-id"], name="payment_date_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["user", "-date", "-id"], name="payment_user_date_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_payment_payment_date_id_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
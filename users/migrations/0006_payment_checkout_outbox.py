@@ -0,0 +1,68 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:20
+
+from django.db import migrations, models
+
+
+def mark_existing_checkouts_created(apps, schema_editor):
+    """Для созданных ранее платежей сессия оплаты уже создана в запросе."""
+    Payment = apps.get_model("users", "Payment")
+    Payment.objects.filter(session_id__isnull=False).update(checkout_status="created")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rents", "0009_rental_rental_start_time_id_idx_and_more"),
+        ("users", "0005_alter_payment_session_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0, verbose_name="Checkout session attempts"
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_error",
+            field=models.TextField(
+                blank=True, null=True, verbose_name="Checkout session error"
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_next_attempt_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Next checkout session attempt"
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_status",
+            field=models.CharField(
+                choices=[
+                    ("not_required", "Not required"),
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("created", "Created"),
+                    ("failed", "Failed"),
+                ],
+                default="not_required",
+                max_length=12,
+                verbose_name="Checkout session status",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("checkout_status__in", ["pending", "processing"])),
+                fields=["checkout_next_attempt_at"],
+                name="payment_checkout_queue_idx",
+            ),
+        ),
+        migrations.RunPython(
+            mark_existing_checkouts_created, migrations.RunPython.noop
+        ),
+    ]
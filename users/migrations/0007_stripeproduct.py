@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_payment_checkout_outbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        max_length=50, unique=True, verbose_name="Product key"
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, verbose_name="Product name")),
+                (
+                    "stripe_product_id",
+                    models.CharField(max_length=255, verbose_name="Stripe product id"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created at"),
+                ),
+            ],
+            options={
+                "verbose_name": "Stripe product",
+                "verbose_name_plural": "Stripe products",
+            },
+        ),
+    ]
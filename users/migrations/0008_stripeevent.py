@@ -0,0 +1,66 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_stripeproduct"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_id",
+                    models.CharField(
+                        max_length=255, unique=True, verbose_name="Stripe event id"
+                    ),
+                ),
+                ("type", models.CharField(max_length=100, verbose_name="Event type")),
+                (
+                    "session_id",
+                    models.CharField(
+                        max_length=255, verbose_name="Checkout session id"
+                    ),
+                ),
+                (
+                    "payment_status",
+                    models.CharField(max_length=20, verbose_name="Payment status"),
+                ),
+                ("created", models.DateTimeField(verbose_name="Created in Stripe")),
+                (
+                    "received_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Received at"),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Processed at"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Stripe event",
+                "verbose_name_plural": "Stripe events",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_at__isnull", True)),
+                        fields=["received_at"],
+                        name="stripe_event_queue_idx",
+                    )
+                ],
+            },
+        ),
+    ]
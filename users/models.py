@@ -34,11 +34,27 @@ class Payment(models.Model):
         ('transfer', 'Bank transfer'),
     ]
     method = models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, verbose_name='Payment method')
-    session_id = models.CharField(max_length=100, blank=True, null=True)
+    session_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     status = models.CharField(max_length=20, blank=True, null=True)
     payment_link = models.URLField(max_length=400, blank=True, null=True, verbose_name='Payment link')
     stripe_product_id = models.CharField(max_length=255, blank=True, null=True)
 
+    # Очередь создания сессий оплаты в Stripe: платёж создаётся в запросе со статусом 'pending',
+    # сессию создаёт фоновая задача users.tasks.process_payment_outbox
+    CHECKOUT_STATUS_CHOICES = [
+        ('not_required', 'Not required'),
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('created', 'Created'),
+        ('failed', 'Failed'),
+    ]
+    checkout_status = models.CharField(max_length=12, choices=CHECKOUT_STATUS_CHOICES, default='not_required',
+                                       verbose_name='Checkout session status')
+    checkout_attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Checkout session attempts')
+    checkout_next_attempt_at = models.DateTimeField(blank=True, null=True,
+                                                    verbose_name='Next checkout session attempt')
+    checkout_error = models.TextField(blank=True, null=True, verbose_name='Checkout session error')
+
     def __str__(self):
         return f"{self.user} - {self.rental} - {self.date} - {self.amount}"
 
@@ -46,3 +62,56 @@ class Payment(models.Model):
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-date']
+        indexes = [
+            # Курсорная пагинация истории платежей
+            models.Index(fields=['-date', '-id'], name='payment_date_id_idx'),
+            models.Index(fields=['user', '-date', '-id'], name='payment_user_date_idx'),
+            # Выборка очереди создания сессий оплаты
+            models.Index(fields=['checkout_next_attempt_at'], name='payment_checkout_queue_idx',
+                         condition=models.Q(checkout_status__in=['pending', 'processing'])),
+        ]
+
+
+class StripeProduct(models.Model):
+    """Продукт Stripe, общий для всех платежей: цена передаётся в сессию оплаты через price_data."""
+
+    key = models.CharField(max_length=50, unique=True, verbose_name='Product key')
+    name = models.CharField(max_length=100, verbose_name='Product name')
+    stripe_product_id = models.CharField(max_length=255, verbose_name='Stripe product id')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created at')
+
+    def __str__(self):
+        return f"{self.name} - {self.stripe_product_id}"
+
+    class Meta:
+        verbose_name = 'Stripe product'
+        verbose_name_plural = 'Stripe products'
+
+
+class StripeEvent(models.Model):
+    """
+    Событие Stripe, полученное через вебхук.
+
+    Уникальный id события исключает повторную обработку при повторной доставке, необработанные
+    события применяются к платежам пакетами фоновой задачей users.tasks.process_stripe_events.
+    """
+
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='Stripe event id')
+    type = models.CharField(max_length=100, verbose_name='Event type')
+    session_id = models.CharField(max_length=255, verbose_name='Checkout session id')
+    payment_status = models.CharField(max_length=20, verbose_name='Payment status')
+    created = models.DateTimeField(verbose_name='Created in Stripe')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Received at')
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name='Processed at')
+
+    def __str__(self):
+        return f"{self.type} - {self.event_id}"
+
+    class Meta:
+        verbose_name = 'Stripe event'
+        verbose_name_plural = 'Stripe events'
+        indexes = [
+            # Выборка очереди необработанных событий
+            models.Index(fields=['received_at'], name='stripe_event_queue_idx',
+                         condition=models.Q(processed_at__isnull=True)),
+        ]
@@ -1,17 +1,19 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination
 
 
-class RentHistoryPaginator(PageNumberPagination):
-    """ Пагинация для истории аренды пользователя. """
+class RentHistoryPaginator(CursorPagination):
+    """ Курсорная пагинация для истории аренды пользователя. """
 
     page_size = 8
     page_size_query_param = 'page_size'
     max_page_size = 10
+    ordering = ('-start_time', '-id')
 
 
-class PaymentsPaginator(PageNumberPagination):
-    """ Пагинация для истории платежей пользователя. """
+class PaymentsPaginator(CursorPagination):
+    """ Курсорная пагинация для истории платежей пользователя. """
 
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 20
+    ordering = ('-date', '-id')
@@ -1,5 +1,33 @@
+from django.core.cache import cache
 from rest_framework import permissions
 
+MODERATORS_GROUP = "moderators"
+MODERATOR_CACHE_TIMEOUT = 60 * 10
+
+
+def moderator_cache_key(user_id):
+    return f"users:is_moderator:{user_id}"
+
+
+def is_moderator(user):
+    """
+    Проверяет, состоит ли пользователь в группе модераторов.
+
+    Результат запоминается в объекте пользователя на время запроса и в общем кэше;
+    запись в кэше сбрасывается при изменении групп пользователя (users.signals).
+    """
+    if not user.is_authenticated:
+        return False
+
+    if not hasattr(user, "_is_moderator"):
+        key = moderator_cache_key(user.pk)
+        value = cache.get(key)
+        if value is None:
+            value = user.groups.filter(name=MODERATORS_GROUP).exists()
+            cache.set(key, value, MODERATOR_CACHE_TIMEOUT)
+        user._is_moderator = value
+    return user._is_moderator
+
 
 class IsOwner(permissions.BasePermission):
     """Только владелец может изменять и удалять свой профиль."""
@@ -15,10 +43,7 @@ class IsModerator(permissions.BasePermission):
     """
 
     def has_permission(self, request, view):
-        return (
-                request.user.groups.filter(name="moderators").exists()
-                or request.user.is_superuser
-        )
+        return request.user.is_superuser or is_moderator(request.user)
 
 
 class IsOwnerOrModerator(IsModerator, IsOwner):
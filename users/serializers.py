@@ -35,3 +35,12 @@ class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = ('id', 'bike', 'date', 'amount', 'method', 'status')
+
+
+class PaymentCheckoutSerializer(serializers.ModelSerializer):
+    """Сериалайзер статуса создания ссылки на оплату."""
+    payment_url = serializers.URLField(source='payment_link', read_only=True)
+
+    class Meta:
+        model = Payment
+        fields = ('id', 'amount', 'checkout_status', 'payment_url', 'checkout_error')
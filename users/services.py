@@ -1,55 +1,100 @@
+import json
 import logging
 
 import stripe
+from django.conf import settings
 
-from config import settings
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from users.models import StripeProduct
+from users.stripe_client import get_stripe_client
 
 logger = logging.getLogger(__name__)
 
+# Общий продукт Stripe для оплаты аренды
+RENTAL_PRODUCT_KEY = "bike-rental"
+RENTAL_PRODUCT_NAME = "Bike rental"
 
-def create_stripe_product(rental):
-    """Создает продукт в Stripe для курса."""
-    product = stripe.Product.create(
-        name=rental,
-        type="service"
-    )
-    logging.info("Strie Product is created.")
-    return product
+# Допустимый возраст подписи вебхука, секунд
+WEBHOOK_TOLERANCE = 300
 
 
-def create_stripe_price(product_id, amount):
-    """ Создаёт цену в stripe. """
-    return stripe.Price.create(
-        currency="usd",
-        product=product_id,
-        unit_amount=int(amount * 100),
-    )
+def get_stripe_product(key=RENTAL_PRODUCT_KEY, name=RENTAL_PRODUCT_NAME):
+    """
+    Возвращает id продукта Stripe для оплаты аренды.
+
+    Продукт создаётся в Stripe один раз и сохраняется в бд, цена каждой аренды передаётся
+    в сессию оплаты через price_data, поэтому отдельные продукт и цена для аренды не создаются.
+    """
+    product = StripeProduct.objects.filter(key=key).first()
+    if product is None:
+        stripe_product = get_stripe_client().create_product(
+            {"name": name, "type": "service"},
+            idempotency_key=f"product-{key}",
+        )
+        logging.info("Stripe Product is created.")
+        # Параллельно созданный продукт имеет тот же id благодаря ключу идемпотентности
+        product, _ = StripeProduct.objects.get_or_create(
+            key=key, defaults={"name": name, "stripe_product_id": stripe_product.id}
+        )
+    return product.stripe_product_id
 
 
-def create_stripe_checkout_session(price_id, user_email):
+def create_stripe_checkout_session(product_id, amount, user_email, idempotency_key=None, client_reference_id=None):
     """Создает сессию оплаты в Stripe."""
     try:
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price': price_id,
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url='http://127.0.0.1:8000/payment-status/?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url='http://127.0.0.1:8000/',
-            customer_email=user_email,
+        session = get_stripe_client().create_checkout_session(
+            {
+                'payment_method_types': ['card'],
+                'line_items': [{
+                    'price_data': {
+                        'currency': 'usd',
+                        'product': product_id,
+                        'unit_amount': int(amount * 100),
+                    },
+                    'quantity': 1,
+                }],
+                'mode': 'payment',
+                'success_url': 'http://127.0.0.1:8000/payment-status/?session_id={CHECKOUT_SESSION_ID}',
+                'cancel_url': 'http://127.0.0.1:8000/',
+                'customer_email': user_email,
+                'client_reference_id': client_reference_id,
+            },
+            idempotency_key=idempotency_key,
         )
         logging.info("Stripe Session is created.")
         return session
     except stripe.error.StripeError as e:
         logging.error(f"Failed to create session: {e}")
-        return None
+        raise
+
+
+def create_payment_checkout(payment):
+    """
+    Создает сессию оплаты в Stripe для платежа. Возвращает id продукта и сессию.
+
+    Ключ идемпотентности строится из id платежа, поэтому повторная попытка после сбоя
+    не создаёт в Stripe дубликат сессии.
+    """
+    product_id = get_stripe_product()
+    session = create_stripe_checkout_session(
+        product_id,
+        payment.amount,
+        payment.user.email,
+        idempotency_key=f"payment-{payment.pk}-session",
+        client_reference_id=str(payment.pk),
+    )
+    return product_id, session
 
 
 def retrieve_stripe_checkout_session(session_id):
     """Проверка статуса платежа"""
-    session = stripe.checkout.Session.retrieve(session_id)
+    session = get_stripe_client().retrieve_checkout_session(session_id)
     return session
+
+
+def construct_webhook_event(payload, signature):
+    """Проверяет подпись вебхука Stripe и возвращает событие. Подпись проверяется локально, без запроса к Stripe."""
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise stripe.SignatureVerificationError("Webhook secret is not configured.", signature)
+    payload = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+    stripe.WebhookSignature.verify_header(payload, signature, settings.STRIPE_WEBHOOK_SECRET, WEBHOOK_TOLERANCE)
+    return json.loads(payload)
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.authentication import invalidate_user_states, restore_user, revoke_user
+from users.models import User
+from users.permissions import moderator_cache_key
+
+
+def invalidate_user_roles(user_ids):
+    """
+    Сбрасывает кэш роли и состояния пользователей после фиксации транзакции.
+
+    До фиксации параллельный запрос прочитал бы из бд старую роль и снова записал её в кэш.
+    """
+    user_ids = list(user_ids)
+
+    def invalidate():
+        cache.delete_many([moderator_cache_key(user_id) for user_id in user_ids])
+        invalidate_user_states(user_ids)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш роли при добавлении или удалении пользователя из групп."""
+
+    if action == "pre_clear" and reverse:
+        # Участники группы, которых удалит group.user_set.clear(), после очистки уже недоступны
+        instance._cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+        return
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        invalidate_user_roles([instance.pk])
+    elif action == "post_clear":
+        # group.user_set.clear()
+        invalidate_user_roles(instance.__dict__.pop("_cleared_user_ids", []))
+    else:
+        # group.user_set.add(...) / remove(...)
+        invalidate_user_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """Сбрасывает кэш роли участников группы при её переименовании или удалении."""
+
+    invalidate_user_roles(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Сбрасывает состояние пользователя в кэше и отзывает токены деактивированного пользователя.
+    """
+
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+
+    user_id, is_active = instance.pk, instance.is_active
+
+    def mark_changed():
+        invalidate_user_states([user_id])
+        if is_active:
+            restore_user(user_id)
+        else:
+            revoke_user(user_id)
+
+    transaction.on_commit(mark_changed)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Отзывает токены удалённого пользователя."""
+
+    revoke_user(instance.pk)
+    invalidate_user_states([instance.pk])
@@ -0,0 +1,138 @@
+import logging
+import time
+from functools import lru_cache
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from users.stripe_fake import fake_stripe
+
+logger = logging.getLogger(__name__)
+
+# Гистограмма задержек запросов к Stripe хранится в кэше: счётчик на каждую корзину,
+# количество запросов, ошибок и сумма задержек по каждой операции.
+LATENCY_KEY_PREFIX = "stripe:latency"
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+SLOW_CALL_MS = 1000
+OPERATIONS = ("products.create", "checkout.sessions.create", "checkout.sessions.retrieve")
+
+
+def _incr(key, delta=1):
+    """Увеличивает счётчик гистограммы."""
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, delta, None)
+
+
+def _bucket(elapsed_ms):
+    return next((str(bound) for bound in LATENCY_BUCKETS_MS if elapsed_ms <= bound), "inf")
+
+
+def record_latency(operation, elapsed_ms, failed=False):
+    prefix = f"{LATENCY_KEY_PREFIX}:{operation}"
+    _incr(f"{prefix}:{_bucket(elapsed_ms)}")
+    _incr(f"{prefix}:count")
+    _incr(f"{prefix}:sum_ms", round(elapsed_ms))
+    if failed:
+        _incr(f"{prefix}:errors")
+
+
+def get_stripe_latency_stats():
+    """Возвращает гистограммы задержек запросов к Stripe по операциям."""
+    buckets = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["inf"]
+    keys = [
+        f"{LATENCY_KEY_PREFIX}:{operation}:{name}"
+        for operation in OPERATIONS
+        for name in buckets + ["count", "errors", "sum_ms"]
+    ]
+    values = cache.get_many(keys)
+
+    stats = {}
+    for operation in OPERATIONS:
+        prefix = f"{LATENCY_KEY_PREFIX}:{operation}"
+        count = values.get(f"{prefix}:count", 0)
+        sum_ms = values.get(f"{prefix}:sum_ms", 0)
+        stats[operation] = {
+            "count": count,
+            "errors": values.get(f"{prefix}:errors", 0),
+            "mean_ms": sum_ms / count if count else None,
+            "buckets_ms": {name: values.get(f"{prefix}:{name}", 0) for name in buckets},
+        }
+    return stats
+
+
+class InstrumentedStripeClient:
+    """
+    Клиент Stripe, измеряющий задержку каждой операции.
+
+    Оборачивает stripe.StripeClient (или локальную замену с тем же интерфейсом) и записывает
+    задержку и результат каждого запроса в гистограмму операции.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def create_product(self, params, idempotency_key=None):
+        return self._call("products.create", self.client.products.create, params, idempotency_key)
+
+    def create_checkout_session(self, params, idempotency_key=None):
+        return self._call("checkout.sessions.create", self.client.checkout.sessions.create, params, idempotency_key)
+
+    def retrieve_checkout_session(self, session_id):
+        return self._call("checkout.sessions.retrieve", self.client.checkout.sessions.retrieve, session_id)
+
+    def _call(self, operation, method, params, idempotency_key=None):
+        options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(params, options=options)
+            failed = False
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            record_latency(operation, elapsed_ms, failed)
+            if elapsed_ms > SLOW_CALL_MS:
+                logger.warning(f"Slow Stripe call {operation}: {elapsed_ms:.0f} ms.")
+
+
+def _create_http_client():
+    """HTTP-клиент с постоянным пулом соединений: TLS-соединение устанавливается один раз на процесс."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        session=session,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_api_client():
+    base_addresses = {"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+    # Повторы сетевых ошибок с экспоненциальной задержкой выполняет библиотека stripe,
+    # повторный POST отправляется с тем же ключом идемпотентности
+    client = stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        base_addresses=base_addresses,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        http_client=_create_http_client(),
+    )
+    return InstrumentedStripeClient(client)
+
+
+def get_stripe_client():
+    """
+    Возвращает клиент Stripe, общий для процесса.
+
+    При STRIPE_FAKE запросы выполняет локальная замена users.stripe_fake, при STRIPE_API_BASE -
+    сервер по этому адресу (например, stripe-mock).
+    """
+    if settings.STRIPE_FAKE:
+        return InstrumentedStripeClient(fake_stripe)
+    return _get_api_client()
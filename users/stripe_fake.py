@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from stripe import APIConnectionError, WebhookSignature
+
+
+class _Resource:
+    """Ресурс Stripe с методами create и retrieve, хранящий объекты в памяти."""
+
+    def __init__(self, fake, prefix, **defaults):
+        self.fake = fake
+        self.prefix = prefix
+        self.defaults = defaults
+
+    def create(self, params=None, options=None):
+        return self.fake.create(self, (options or {}).get("idempotency_key"), params or {})
+
+    def retrieve(self, object_id, params=None, options=None):
+        return self.fake.objects[object_id]
+
+
+class FakeStripe:
+    """
+    Локальная замена Stripe API для разработки и тестов без сети.
+
+    Повторяет используемую часть интерфейса stripe.StripeClient (products, checkout.sessions),
+    учитывает ключи идемпотентности и позволяет имитировать недоступность API.
+    Включается настройкой STRIPE_FAKE.
+    """
+
+    def __init__(self):
+        self.products = _Resource(self, "prod")
+        self.checkout = SimpleNamespace(sessions=_Resource(self, "cs", payment_status="unpaid"))
+        self.reset()
+
+    def reset(self):
+        self.objects = {}
+        self.idempotency_keys = {}
+        self.calls = []
+        self.failures = 0
+        self.ids = count(1)
+
+    def fail_next(self, times=1):
+        """Следующие times запросов завершатся ошибкой соединения."""
+        self.failures = times
+
+    def create(self, resource, idempotency_key, params):
+        self.calls.append(resource.prefix)
+        if self.failures:
+            self.failures -= 1
+            raise APIConnectionError("Fake Stripe API is unavailable.")
+
+        if idempotency_key in self.idempotency_keys:
+            return self.idempotency_keys[idempotency_key]
+
+        object_id = f"{resource.prefix}_fake_{next(self.ids)}"
+        obj = SimpleNamespace(id=object_id, **resource.defaults, **params)
+        if resource.prefix == "cs":
+            obj.url = f"https://checkout.stripe.test/pay/{object_id}"
+        self.objects[object_id] = obj
+        if idempotency_key:
+            self.idempotency_keys[idempotency_key] = obj
+        return obj
+
+    def pay(self, session_id):
+        """Отмечает сессию оплаты как оплаченную."""
+        self.objects[session_id].payment_status = "paid"
+
+    def webhook(self, session_id, secret, event_type="checkout.session.completed", payment_status="paid"):
+        """Возвращает тело и заголовок Stripe-Signature вебхука о сессии оплаты, подписанные секретом."""
+        payload = json.dumps({
+            "id": f"evt_fake_{next(self.ids)}",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": {"id": session_id, "object": "checkout.session", "payment_status": payment_status}},
+        })
+        timestamp = int(time.time())
+        signature = WebhookSignature._compute_signature(f"{timestamp}.{payload}", secret)
+        return payload, f"t={timestamp},v1={signature}"
+
+
+class _FakeStripeHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов Stripe API к FakeStripeServer."""
+
+    protocol_version = "HTTP/1.1"
+    objects = {"/v1/products": "product", "/v1/checkout/sessions": "checkout.session"}
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        fake = self.server.fake
+        resources = {"/v1/products": fake.products, "/v1/checkout/sessions": fake.checkout.sessions}
+        if self.path not in resources:
+            return self.respond(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+        try:
+            obj = fake.create(resources[self.path], self.headers.get("Idempotency-Key"), dict(parse_qsl(body)))
+        except APIConnectionError as e:
+            return self.respond(503, {"error": {"type": "api_error", "message": str(e)}})
+        self.respond(200, {"object": self.objects[self.path], **vars(obj)})
+
+    def do_GET(self):
+        self.server.requests += 1
+        prefix = "/v1/checkout/sessions/"
+        obj = self.server.fake.objects.get(self.path.split("?")[0][len(prefix):])
+        if not self.path.startswith(prefix) or obj is None:
+            return self.respond(404, {"error": {"type": "invalid_request_error", "message": "No such session"}})
+        self.respond(200, {"object": "checkout.session", **vars(obj)})
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Stripe-Should-Retry", "true")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    Локальный HTTP-сервер с API Stripe поверх FakeStripe.
+
+    Позволяет проверить настоящий клиент Stripe (пул соединений, таймауты, повторы) без сети:
+    адрес сервера передаётся в настройку STRIPE_API_BASE. Считает соединения и запросы.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fake, address=("127.0.0.1", 0)):
+        super().__init__(address, _FakeStripeHandler)
+        self.fake = fake
+        self.connections = 0
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+fake_stripe = FakeStripe()
@@ -0,0 +1,152 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction
+from django.utils.timezone import now
+from stripe import APIConnectionError, APIError, RateLimitError, StripeError
+
+from rents.models import Rental
+from users.models import Payment, StripeEvent
+from users.services import create_payment_checkout
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+# Платёж, взятый в обработку и не обработанный за это время, снова попадает в очередь
+PROCESSING_TIMEOUT = timedelta(minutes=5)
+# Временные ошибки Stripe, после которых запрос повторяется
+RETRYABLE_ERRORS = (APIConnectionError, APIError, RateLimitError)
+
+EVENTS_BATCH_SIZE = 500
+
+
+def claim_payments(batch_size):
+    """
+    Забирает из очереди пакет платежей, ожидающих создания сессии оплаты.
+
+    Строки блокируются с SKIP LOCKED, поэтому несколько воркеров разбирают очередь параллельно,
+    не получая одни и те же платежи.
+    """
+    with transaction.atomic():
+        ids = list(
+            Payment.objects.filter(
+                checkout_status__in=["pending", "processing"], checkout_next_attempt_at__lte=now()
+            )
+            .order_by("checkout_next_attempt_at")
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Payment.objects.filter(id__in=ids).update(
+            checkout_status="processing", checkout_next_attempt_at=now() + PROCESSING_TIMEOUT
+        )
+    return list(Payment.objects.filter(id__in=ids).select_related("user", "rental__rented_bike"))
+
+
+def process_payment(payment):
+    """Создает сессию оплаты для платежа и сохраняет результат. Возвращает новый статус."""
+    try:
+        product_id, session = create_payment_checkout(payment)
+    except StripeError as e:
+        attempts = payment.checkout_attempts + 1
+        if isinstance(e, RETRYABLE_ERRORS) and attempts < MAX_ATTEMPTS:
+            checkout_status, next_attempt_at = "pending", now() + RETRY_DELAY * 2 ** (attempts - 1)
+            logger.warning(f"Checkout session for payment {payment.pk} is postponed: {e}.")
+        else:
+            checkout_status, next_attempt_at = "failed", None
+            logger.error(f"Checkout session for payment {payment.pk} is failed: {e}.")
+
+        Payment.objects.filter(id=payment.pk).update(
+            checkout_status=checkout_status,
+            checkout_attempts=attempts,
+            checkout_next_attempt_at=next_attempt_at,
+            checkout_error=str(e),
+        )
+        return checkout_status
+
+    Payment.objects.filter(id=payment.pk).update(
+        checkout_status="created",
+        checkout_attempts=payment.checkout_attempts + 1,
+        checkout_next_attempt_at=None,
+        checkout_error=None,
+        session_id=session.id,
+        payment_link=session.url,
+        stripe_product_id=product_id,
+    )
+    logger.info(f"Payment link is created for {payment.rental_id}.")
+    return "created"
+
+
+@shared_task
+def process_payment_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Фоновая задача для создания сессий оплаты в Stripe.
+
+    Обрабатывает очередь платежей пакетами: платёж создаётся в запросе со статусом 'pending',
+    задача создаёт для него сессию оплаты и сохраняет ссылку на оплату.
+    При временной ошибке Stripe попытка повторяется с экспоненциальной задержкой,
+    после MAX_ATTEMPTS попыток или при постоянной ошибке платёж получает статус 'failed'.
+    Если пакет заполнен целиком, задача ставит себя в очередь снова.
+    """
+    payments = claim_payments(batch_size)
+
+    result = {"processed": len(payments), "created": 0, "pending": 0, "failed": 0}
+    for payment in payments:
+        result[process_payment(payment)] += 1
+
+    if len(payments) == batch_size:
+        process_payment_outbox.delay(batch_size)
+    return result
+
+
+def apply_stripe_events(events):
+    """
+    Применяет события Stripe к платежам и арендам.
+
+    Для каждой сессии оплаты берётся итоговый статус: последнее по времени событие, при этом
+    оплаченный платёж не возвращается в другой статус. Платежи с одинаковым статусом и аренды
+    оплаченных платежей обновляются одним запросом.
+    """
+    statuses = {}
+    for event in sorted(events, key=lambda event: event.created):
+        if statuses.get(event.session_id) != "paid":
+            statuses[event.session_id] = event.payment_status
+
+    sessions_by_status = defaultdict(list)
+    for session_id, payment_status in statuses.items():
+        sessions_by_status[payment_status].append(session_id)
+
+    for payment_status, session_ids in sessions_by_status.items():
+        Payment.objects.filter(session_id__in=session_ids).exclude(status="paid").update(status=payment_status)
+
+    paid = sessions_by_status.get("paid")
+    if paid:
+        Rental.objects.filter(payments__session_id__in=paid).exclude(status="completed").update(status="completed")
+    return len(statuses)
+
+
+@shared_task
+def process_stripe_events(batch_size=EVENTS_BATCH_SIZE):
+    """
+    Фоновая задача для применения событий Stripe, полученных вебхуком.
+
+    Забирает пакет необработанных событий (SKIP LOCKED) и применяет его к платежам и арендам
+    в одной транзакции. Если пакет заполнен целиком, задача ставит себя в очередь снова.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.filter(processed_at__isnull=True)
+            .order_by("received_at")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        sessions = apply_stripe_events(events)
+        StripeEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=now())
+
+    if events:
+        logger.info(f"{len(events)} Stripe events are applied to {sessions} payments.")
+    if len(events) == batch_size:
+        process_stripe_events.delay(batch_size)
+    return {"processed": len(events), "sessions": sessions}
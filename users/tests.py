@@ -1,9 +1,34 @@
+import gzip
+import json
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
 from django.urls import reverse
+from django.utils.timezone import now
+from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from bikes.models import Bicycle
+from config.compression import get_compression_stats
+from rents.models import Rental
+from users.models import Payment, StripeEvent, StripeProduct
+from users.permissions import is_moderator
+from users.stripe_client import (_get_api_client, get_stripe_client,
+                                 get_stripe_latency_stats)
+from users.stripe_fake import FakeStripeServer, fake_stripe
+from users.tasks import (MAX_ATTEMPTS, process_payment_outbox,
+                         process_stripe_events)
 
 
 class UserTestCase(APITestCase):
@@ -176,3 +201,635 @@ class UserRegistrationTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("password", response.data)
         self.assertEqual(response.data["password"][0], "This field is required.")
+
+
+class UserHistoryPaginationTest(APITestCase):
+    """Тесты курсорной пагинации истории аренды и платежей пользователя."""
+
+    def setUp(self):
+        self.user = baker.make(get_user_model())
+        self.client.force_authenticate(user=self.user)
+        rentals = baker.make(Rental, renter=self.user, _quantity=10)
+        baker.make(Rental, _quantity=3)  # чужие аренды
+        baker.make(Payment, user=self.user, rental=rentals[0], _quantity=12)
+
+    def test_rent_history_pagination(self):
+        """Тест постраничного вывода истории аренды пользователя."""
+
+        response = self.client.get(reverse("users:user-history"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 8)
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNone(response.data["next"])
+
+    def test_payments_pagination(self):
+        """Тест постраничного вывода истории платежей пользователя."""
+
+        response = self.client.get(reverse("users:payments-history"), {"page_size": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertNotIn("count", response.data)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_payments_fields(self):
+        """Тест выборочных полей истории платежей."""
+
+        response = self.client.get(reverse("users:payments-history"), {"fields": "id,bike"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data["results"][0]), {"id", "bike"})
+        self.assertIsNotNone(response.data["next"])
+
+
+class PaymentIndexUsageTest(APITestCase):
+    """Тесты использования индексов платежей и аренд (EXPLAIN) на заполненных таблицах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = baker.make(get_user_model(), _quantity=20)
+        rentals = Rental.objects.bulk_create(
+            Rental(renter=cls.users[i % 20], status="completed") for i in range(2000)
+        )
+        Payment.objects.bulk_create(
+            Payment(user=cls.users[i % 20], rental=rentals[i], method="transfer", session_id=f"cs_test_{i}")
+            for i in range(2000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE rents_rental")
+            cursor.execute("ANALYZE users_payment")
+
+    def setUp(self):
+        # Исключаем последовательное сканирование, чтобы план не зависел от размера тестовых данных
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_session_id_unique_index(self):
+        """Тест поиска платежа по session_id через уникальный индекс."""
+
+        plan = Payment.objects.filter(session_id="cs_test_15").explain()
+        self.assertIn("users_payment_session_id", plan)
+
+    def test_user_payments_index(self):
+        """Тест выборки платежей пользователя в порядке курсорной пагинации."""
+
+        plan = Payment.objects.filter(user=self.users[0]).order_by("-date", "-id")[:10].explain()
+        self.assertIn("payment_user_date_idx", plan)
+
+    def test_rent_history_index(self):
+        """Тест выборки истории аренды пользователя в порядке курсорной пагинации."""
+
+        plan = Rental.objects.filter(renter=self.users[0]).order_by("-start_time", "-id")[:8].explain()
+        self.assertIn("rental_renter_start_time_idx", plan)
+
+
+class GenerateDatasetCommandTest(APITestCase):
+    """Тесты команды генерации тестового набора данных."""
+
+    def test_generate_dataset(self):
+        """Тест генерации велосипедов, пользователей, аренд и платежей."""
+
+        call_command(
+            "generate_dataset", bikes=20, users=30, rentals=100, batch_size=40, pending_ratio=0, stdout=StringIO()
+        )
+
+        self.assertEqual(Bicycle.objects.count(), 20)
+        self.assertEqual(get_user_model().objects.count(), 30)
+        self.assertEqual(Rental.objects.count(), 100)
+
+        # Активные аренды занимают велосипеды, у каждого пользователя не больше одной
+        self.assertEqual(Rental.objects.filter(status="active").count(), 6)
+        self.assertEqual(Bicycle.objects.filter(is_rented=True).count(), 6)
+
+        # Каждая завершённая аренда оплачена
+        self.assertEqual(Payment.objects.count(), 94)
+        self.assertFalse(Rental.objects.filter(status="completed", payments__isnull=True).exists())
+
+        # Новые записи создаются после сгенерированных
+        self.assertGreater(baker.make(Bicycle).pk, 20)
+
+    def test_generate_dataset_again(self):
+        """Тест повторной генерации без --clear: активные аренды не нарушают ограничений."""
+
+        call_command("generate_dataset", bikes=10, users=10, rentals=30, batch_size=7, stdout=StringIO())
+        call_command(
+            "generate_dataset", bikes=10, users=10, rentals=30, batch_size=7, active_ratio=1, stdout=StringIO()
+        )
+
+        self.assertEqual(Rental.objects.count(), 60)
+        self.assertEqual(Rental.objects.filter(status="active").count(), 13)
+        self.assertEqual(Rental.objects.filter(status="active").values("renter").distinct().count(), 13)
+        self.assertGreater(baker.make(Rental).pk, 60)
+
+
+class ExportTest(APITestCase):
+    """Тесты потоковой выгрузки аренд и платежей."""
+
+    def setUp(self):
+        cache.clear()
+        self.moder = baker.make(get_user_model(), email="moder@example.com")
+        self.moder.groups.add(Group.objects.get_or_create(name="moderators")[0])
+        self.client.force_authenticate(user=self.moder)
+
+        self.user = baker.make(get_user_model(), email="renter@example.com")
+        self.rental = baker.make(Rental, renter=self.user, rental_cost=Decimal("12.50"))
+        self.cash = baker.make(Payment, user=self.user, rental=self.rental, amount=Decimal("12.50"), method="cash")
+        self.transfer = baker.make(Payment, user=self.user, rental=self.rental, method="transfer")
+        self.url = reverse("users:payments-export")
+
+    def test_payments_csv(self):
+        """Тест выгрузки платежей в csv с фильтром истории платежей."""
+
+        response = self.client.get(self.url, {"method": "cash"}, HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="payments.csv"', response["Content-Disposition"])
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,user,rental,date,amount,method,status,session_id")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"{self.cash.pk},renter@example.com,{self.rental.pk},"))
+        self.assertIn(",12.50,cash,", lines[1])
+
+    def test_rentals_ndjson(self):
+        """Тест выгрузки аренд в ndjson."""
+
+        response = self.client.get(reverse("rents:rent-export"), {"file_format": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["renter"], "renter@example.com")
+        self.assertEqual(rows[0]["rental_cost"], "12.50")
+
+    def test_compressed_stream(self):
+        """Тест сжатия потоковой выгрузки по частям."""
+
+        plain = b"".join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), plain)
+        self.assertEqual(get_compression_stats()["gzip"]["bytes_in"], len(plain))
+
+    def test_errors(self):
+        """Тест: выгрузка только для модератора, неизвестный формат и неверный фильтр - ошибка 400."""
+
+        response = self.client.get(self.url, {"file_format": "xlsx"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"method": "card"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(reverse("rents:rent-export")).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_command(self):
+        """Тест команды выгрузки в файл и в stdout."""
+
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as output:
+            call_command("export_data", "payments", format="ndjson", method="transfer", output=output.name)
+            rows = [json.loads(line) for line in output.read().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.transfer.pk])
+
+        stdout = StringIO()
+        call_command("export_data", "rentals", stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 2)
+
+        with self.assertRaises(CommandError):
+            call_command("export_data", "payments", method="card", stdout=StringIO())
+
+
+class RunBenchmarksCommandTest(APITestCase):
+    """Тесты команды замера производительности."""
+
+    def setUp(self):
+        cache.clear()
+        call_command("generate_dataset", bikes=10, users=10, rentals=50, stdout=StringIO())
+
+    def test_run_benchmarks(self):
+        """Тест записи результатов замеров в JSON и сравнения с предыдущим запуском."""
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "run_benchmarks", iterations=3, warmup=1, alloc_iterations=1, output=output.name, stdout=StringIO()
+            )
+            report = json.load(output)
+
+        results = report["results"]
+        for name in ("available_bikes", "rent_bike", "return_bike", "user_rent_history", "payment_list_moderator",
+                     "pricing_batch", "json_render_orjson", "db_connection_new", "db_connection_persistent"):
+            self.assertIn(name, results)
+            self.assertIn("p99", results[name]["latency_ms"])
+        self.assertEqual(results["available_bikes"]["queries"], 0)
+
+        # Замеры откатываются и не меняют данные
+        self.assertEqual(Rental.objects.count(), 50)
+        self.assertFalse(get_user_model().objects.filter(email="benchmark-moderator@example.com").exists())
+
+        # Рост количества запросов относительно предыдущего запуска считается регрессией
+        results["user_rent_history"]["queries"] = 0
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as baseline:
+            json.dump(report, baseline)
+            baseline.flush()
+            with self.assertRaisesMessage(CommandError, "user_rent_history: queries"):
+                call_command(
+                    "run_benchmarks", only=["user_rent_history"], iterations=3, warmup=1, alloc_iterations=1,
+                    baseline=baseline.name, tolerance=100, stdout=StringIO(),
+                )
+
+    def test_benchmarks_use_own_cache(self):
+        """Тест: замеры не меняют общий кэш, работа после фиксации выполняется в замере."""
+
+        cache.set("bikes:available:generation", 1, None)
+        with mock.patch("rents.views.refresh_bike_availability") as refresh:
+            call_command(
+                "run_benchmarks", only=["available_bikes_cold", "rent_bike", "return_bike"], iterations=2,
+                warmup=1, alloc_iterations=1, stdout=StringIO(),
+            )
+
+        self.assertEqual(cache.get("bikes:available:generation"), 1)
+        # Аренда и возврат: прогрев, замеры, подсчёт запросов и проход tracemalloc
+        self.assertEqual(refresh.call_count, 10)
+
+
+class ModeratorRoleCacheTest(APITestCase):
+    """Тесты кэширования роли модератора."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = baker.make(get_user_model())
+        self.group, _ = Group.objects.get_or_create(name="moderators")
+
+    def fresh_user(self):
+        # Новый объект пользователя, как в новом запросе
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_role_is_cached(self):
+        """Тест: роль проверяется запросом к бд только один раз."""
+
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertFalse(is_moderator(user))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertFalse(is_moderator(user))
+
+    def test_cache_invalidation_on_group_change(self):
+        """Тест сброса кэша роли при изменении групп пользователя."""
+
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.add(self.user)
+        self.assertTrue(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.add(self.user)
+        self.assertTrue(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.clear()
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+    def test_cache_invalidation_after_commit(self):
+        """Тест: кэш роли сбрасывается только после фиксации транзакции."""
+
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.groups.add(self.group)
+            # Параллельный запрос до фиксации видит роль из кэша
+            self.assertFalse(is_moderator(self.fresh_user()))
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertTrue(is_moderator(self.fresh_user()))
+
+    def test_cache_invalidation_on_group_rename(self):
+        """Тест сброса кэша роли при переименовании группы модераторов."""
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(is_moderator(self.fresh_user()))
+
+        self.group.name = "former moderators"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.save()
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+
+class ClaimsAuthenticationTest(APITestCase):
+    """Тесты аутентификации по данным токена."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email="claims@test.com", password=make_password("password"))
+        self.url = reverse("bikes:available-bikes")
+        response = self.client.post(
+            reverse("users:token_obtain_pair"), {"email": "claims@test.com", "password": "password"}
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        # Прогрев индекса доступных велосипедов
+        self.client.get(self.url)
+
+    def test_read_without_queries(self):
+        """Тест: запрос на чтение не обращается к таблице пользователей."""
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_is_rejected(self):
+        """Тест: токены деактивированного пользователя отклоняются."""
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changed_user_is_loaded_from_db(self):
+        """Тест: после изменения ролей пользователь один раз загружается из бд."""
+
+        group, _ = Group.objects.get_or_create(name="moderators")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+
+        # Загрузка пользователя, проверка группы модератора и история аренды
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("users:user-history"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_demoted_user_loses_rights(self):
+        """Тест: после снятия роли модератора токен, выданный модератору, не даёт его прав."""
+
+        group, _ = Group.objects.get_or_create(name="moderators")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        self.assertEqual(self.client.get(reverse("rents:rent-list")).status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+        response = self.client.get(reverse("rents:rent-list"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_privileges_are_not_read_from_token(self):
+        """Тест: права в данных токена не учитываются."""
+
+        token = AccessToken.for_user(self.user)
+        token["is_superuser"] = token["is_staff"] = token["is_moderator"] = True
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        response = self.client.get(reverse("rents:rent-list"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_evicted_cache_fails_closed(self):
+        """Тест: без записей в кэше пользователь проверяется по бд."""
+
+        # Деактивация без сигналов и потеря кэша (вытеснение, перезапуск Redis)
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# Воркер Celery заменяется синхронным выполнением задач
+@override_settings(STRIPE_FAKE=True, CELERY_TASK_ALWAYS_EAGER=True)
+class PaymentOutboxTest(APITestCase):
+    """Тесты создания ссылки на оплату через очередь платежей."""
+
+    def setUp(self):
+        fake_stripe.reset()
+        self.user = baker.make(get_user_model())
+        self.client.force_authenticate(user=self.user)
+        bike = baker.make(Bicycle, rental_cost_hour=Decimal("5.00"), rental_cost_day=Decimal("50.00"))
+        self.rental = baker.make(
+            Rental, renter=self.user, rented_bike=bike, status="pending", pricing_status="calculated",
+            rental_cost=Decimal("10.00")
+        )
+        self.url = reverse("users:payment")
+
+    def test_payment_is_queued(self):
+        """Тест: запрос сохраняет платёж в очереди, не обращаясь к Stripe."""
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url, {"rental_id": self.rental.pk})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["checkout_status"], "pending")
+        self.assertIsNone(response.data["payment_url"])
+        self.assertEqual(fake_stripe.calls, [])
+        self.assertEqual(len(callbacks), 1)
+
+        # Повторный запрос не создаёт второй платёж
+        response = self.client.post(self.url, {"rental_id": self.rental.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_request_does_not_call_stripe(self):
+        """Тест: после фиксации транзакции задача ставится в очередь, запрос не обращается к Stripe."""
+
+        with mock.patch("users.views.process_payment_outbox.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, {"rental_id": self.rental.pk})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        delay.assert_called_once_with()
+        self.assertEqual(fake_stripe.calls, [])
+        self.assertEqual(Payment.objects.get().checkout_status, "pending")
+
+    def test_checkout_link_is_created_by_worker(self):
+        """Тест: фоновая задача создаёт ссылку, клиент получает её по status_url."""
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"rental_id": self.rental.pk})
+
+        response = self.client.get(response.data["status_url"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["checkout_status"], "created")
+        self.assertTrue(response.data["payment_url"].startswith("https://checkout.stripe.test/"))
+        self.assertEqual(fake_stripe.calls, ["prod", "cs"])
+        self.assertEqual(Payment.objects.get().stripe_product_id, StripeProduct.objects.get().stripe_product_id)
+
+    def test_product_is_reused(self):
+        """Тест: продукт Stripe создаётся один раз, для следующих платежей нужен один запрос к Stripe."""
+
+        for _ in range(2):
+            rental = baker.make(
+                Rental, renter=self.user, rented_bike=self.rental.rented_bike, status="pending",
+                pricing_status="calculated", rental_cost=Decimal("10.00")
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url, {"rental_id": rental.pk})
+
+        self.assertEqual(fake_stripe.calls, ["prod", "cs", "cs"])
+        self.assertEqual(set(Payment.objects.values_list("stripe_product_id", flat=True)),
+                         {StripeProduct.objects.get().stripe_product_id})
+
+    def test_retry_after_stripe_error(self):
+        """Тест: после временной ошибки Stripe попытка повторяется без дубликатов в Stripe."""
+
+        fake_stripe.fail_next(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {"rental_id": self.rental.pk})
+
+        payment = Payment.objects.get()
+        self.assertEqual(payment.checkout_status, "pending")
+        self.assertEqual(payment.checkout_attempts, 1)
+        response = self.client.get(reverse("users:payment-checkout", kwargs={"pk": payment.pk}))
+        self.assertEqual(response["Retry-After"], "1")
+
+        # Повторная попытка наступает после задержки
+        Payment.objects.update(checkout_next_attempt_at=now())
+        result = process_payment_outbox()
+
+        self.assertEqual(result["created"], 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.checkout_status, "created")
+        self.assertEqual(payment.checkout_attempts, 2)
+        self.assertEqual(len(fake_stripe.objects), 2)
+
+    def test_failed_after_max_attempts(self):
+        """Тест: после исчерпания попыток платёж получает статус 'failed'."""
+
+        payment = baker.make(
+            Payment, user=self.user, rental=self.rental, amount=Decimal("10.00"), method="transfer",
+            checkout_status="pending", checkout_attempts=MAX_ATTEMPTS - 1, checkout_next_attempt_at=now()
+        )
+        fake_stripe.fail_next(1)
+
+        self.assertEqual(process_payment_outbox()["failed"], 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.checkout_status, "failed")
+        self.assertIsNone(payment.checkout_next_attempt_at)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test", CELERY_TASK_ALWAYS_EAGER=True)
+class StripeWebhookTest(APITestCase):
+    """Тесты получения статусов оплаты через вебхук Stripe."""
+
+    def setUp(self):
+        self.user = baker.make(get_user_model())
+        self.rental = baker.make(Rental, renter=self.user, status="pending")
+        self.payment = baker.make(
+            Payment, user=self.user, rental=self.rental, method="transfer", session_id="cs_test_1", status=None
+        )
+        self.url = reverse("users:stripe-webhook")
+
+    def send(self, payload, signature):
+        return self.client.post(self.url, payload, content_type="application/json", HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_invalid_signature(self):
+        """Тест: событие с неверной подписью отклоняется."""
+
+        payload, signature = fake_stripe.webhook("cs_test_1", "whsec_other")
+        response = self.send(payload, signature)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_payment_is_completed(self):
+        """Тест: событие применяется к платежу и аренде, страница статуса читает только бд."""
+
+        status_url = reverse("users:payment_status")
+        response = self.client.get(status_url, {"session_id": "cs_test_1"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        payload, signature = fake_stripe.webhook("cs_test_1", "whsec_test")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send(payload, signature)
+            # Повторная доставка того же события
+            self.send(payload, signature)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+        self.payment.refresh_from_db()
+        self.rental.refresh_from_db()
+        self.assertEqual(self.payment.status, "paid")
+        self.assertEqual(self.rental.status, "completed")
+        self.assertIsNotNone(StripeEvent.objects.get().processed_at)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(status_url, {"session_id": "cs_test_1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_events_are_applied_in_batch(self):
+        """Тест: пакет событий применяется несколькими запросами, оплата не откатывается."""
+
+        rentals = baker.make(Rental, renter=self.user, status="pending", _quantity=5)
+        for index, rental in enumerate(rentals):
+            baker.make(Payment, user=self.user, rental=rental, method="transfer", session_id=f"cs_batch_{index}")
+            for payment_status in ("paid", "unpaid"):
+                payload, signature = fake_stripe.webhook(f"cs_batch_{index}", "whsec_test",
+                                                         payment_status=payment_status)
+                self.send(payload, signature)
+
+        # Точка сохранения, выборка событий, обновление платежей, аренд и отметка событий обработанными
+        with self.assertNumQueries(6):
+            result = process_stripe_events()
+
+        self.assertEqual(result, {"processed": 10, "sessions": 5})
+        self.assertEqual(Rental.objects.filter(status="completed").count(), 5)
+        self.assertEqual(Payment.objects.filter(session_id__startswith="cs_batch_", status="paid").count(), 5)
+
+
+class StripeClientTest(APITestCase):
+    """Тесты клиента Stripe с локальным сервером Stripe API."""
+
+    def setUp(self):
+        cache.clear()
+        fake_stripe.reset()
+        self.server = self.enterContext(FakeStripeServer(fake_stripe))
+        self.enterContext(
+            override_settings(STRIPE_FAKE=False, STRIPE_SECRET_KEY="sk_test_fake", STRIPE_API_BASE=self.server.url)
+        )
+        _get_api_client.cache_clear()
+        self.addCleanup(_get_api_client.cache_clear)
+
+    def test_connection_is_reused(self):
+        """Тест: запросы к Stripe идут через одно постоянное соединение и попадают в гистограмму."""
+
+        client = get_stripe_client()
+        for index in range(3):
+            product = client.create_product({"name": f"Product {index}"}, idempotency_key=f"product-{index}")
+            self.assertTrue(product.id.startswith("prod_fake_"))
+
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.server.connections, 1)
+
+        stats = get_stripe_latency_stats()["products.create"]
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(sum(stats["buckets_ms"].values()), 3)
+
+    def test_retry_after_server_error(self):
+        """Тест: временная ошибка Stripe повторяется клиентом с тем же ключом идемпотентности."""
+
+        fake_stripe.fail_next(1)
+        session = get_stripe_client().create_checkout_session({"mode": "payment"}, idempotency_key="session-1")
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(fake_stripe.idempotency_keys["session-1"].id, session.id)
+        self.assertEqual(get_stripe_client().retrieve_checkout_session(session.id).payment_status, "unpaid")
+        stats = get_stripe_latency_stats()
+        self.assertEqual(stats["checkout.sessions.create"]["errors"], 0)
+        self.assertEqual(stats["checkout.sessions.retrieve"]["count"], 1)
@@ -4,8 +4,9 @@ from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView)
 
 from users.apps import UsersConfig
-from users.views import (CreatePaymentView, PaymentListView, PaymentStatusView,
-                         UserApiDetailView, UserApiList,
+from users.views import (CreatePaymentView, PaymentCheckoutView,
+                         PaymentExportView, PaymentListView, PaymentStatusView,
+                         StripeWebhookView, UserApiDetailView, UserApiList,
                          UserRegistrationAPIView, UserRentHistory)
 
 app_name = UsersConfig.name
@@ -24,6 +25,9 @@ urlpatterns = [
 
     # payments
     path('users/payments/', PaymentListView.as_view(), name='payments-history'),
+    path('users/payments/export/', PaymentExportView.as_view(), name='payments-export'),
     path('rental_payment/', CreatePaymentView.as_view(), name='payment'),  # method POST
+    path('users/payments/<int:pk>/checkout/', PaymentCheckoutView.as_view(), name='payment-checkout'),
     path('payment-status/', PaymentStatusView.as_view(), name='payment_status'),
+    path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
 ]
@@ -1,24 +1,33 @@
 import logging
+from datetime import datetime, timezone
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils.timezone import now
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from stripe import StripeError
 
+from config.exports import ExportAPIView
+from config.replicas import ReplicaReadMixin
+from config.sparse_fields import SparseFieldsMixin
 from rents.models import Rental
+from users.exports import PAYMENT_COLUMNS, payment_export_queryset
 from users.filters import PaymentFilterSet
-from users.models import Payment
+from users.models import Payment, StripeEvent
 from users.paginators import PaymentsPaginator, RentHistoryPaginator
-from users.permissions import IsModerator, IsOwner, IsOwnerOrModerator
-from users.serializers import (BikeRentalHistorySerializer, PaymentSerializer,
+from users.permissions import (IsModerator, IsOwner, IsOwnerOrModerator,
+                               is_moderator)
+from users.serializers import (BikeRentalHistorySerializer,
+                               PaymentCheckoutSerializer, PaymentSerializer,
                                UserSerializer)
-from users.services import (create_stripe_checkout_session,
-                            create_stripe_price, create_stripe_product,
-                            retrieve_stripe_checkout_session)
+from users.services import construct_webhook_event
+from users.tasks import process_payment_outbox, process_stripe_events
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +36,7 @@ class UserApiList(generics.ListAPIView):
     """Представление для вывода списка пользователей."""
 
     serializer_class = UserSerializer
-    queryset = get_user_model().objects.all()
+    queryset = get_user_model().objects.order_by("id")
     permission_classes = [IsAuthenticated, IsModerator]
 
 
@@ -77,24 +86,27 @@ class UserApiDetailView(generics.RetrieveUpdateDestroyAPIView):
         return super().get_permissions()
 
 
-class UserRentHistory(APIView):
+class UserRentHistory(ReplicaReadMixin, generics.ListAPIView):
     """ Представление для просмотра истории аренды велосипедов пользователя."""
 
     permission_classes = [IsAuthenticated]
     serializer_class = BikeRentalHistorySerializer
     pagination_class = RentHistoryPaginator
 
-    def get(self, request):
-        history = Rental.objects.filter(renter=self.request.user)
-        serializer = self.serializer_class(history, many=True)
-        return Response(serializer.data)
+    def get_queryset(self):
+        return Rental.objects.filter(renter=self.request.user).select_related("rented_bike")
 
 
 class CreatePaymentView(APIView):
-    """Представление для создания ссылки на оплату."""
+    """
+    Представление для создания ссылки на оплату.
+
+    Платёж сохраняется со статусом 'pending' и ставится в очередь, ссылку на оплату создаёт
+    фоновая задача. Клиент получает ссылку по адресу status_url из ответа.
+    """
 
     permission_classes = [IsAuthenticated]
-    serializer_class = PaymentSerializer
+    serializer_class = PaymentCheckoutSerializer
 
     def post(self, request):
         rental_id = request.data.get('rental_id')
@@ -102,14 +114,11 @@ class CreatePaymentView(APIView):
             logging.warning("Rental ID is not provided.")
             return Response({'error': 'Rental ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user_email = request.user.email
-
-        try:
-            # Получает запись об аренде
-            rental = get_object_or_404(Rental, id=rental_id)
-            user = rental.renter
-            if request.user != user:
-                logging.warning(f"{request.user} is not authorized to return bike {rental.rented_bike.pk}.")
+        with transaction.atomic():
+            # Получает запись об аренде, блокируя её от параллельного создания платежа
+            rental = get_object_or_404(Rental.objects.select_for_update(), id=rental_id)
+            if rental.renter_id != request.user.pk:
+                logging.warning(f"{request.user} is not authorized to return bike {rental.rented_bike_id}.")
                 return Response({"error": "Not authorized to return this bike."},
                                 status=status.HTTP_403_FORBIDDEN, )
 
@@ -117,44 +126,67 @@ class CreatePaymentView(APIView):
                 logging.warning(f"Rental status is invalid: {rental.status}.")
                 return Response({'error': 'Invalid rental status'}, status=status.HTTP_400_BAD_REQUEST)
 
+            if rental.pricing_status != 'calculated':
+                logging.warning(f"Rental cost is not calculated yet: {rental.pricing_status}.")
+                return Response({'error': 'Rental cost is not calculated yet', 'pricing_status': rental.pricing_status},
+                                status=status.HTTP_409_CONFLICT)
+
             if rental.rental_cost <= 0:
                 logging.warning(f"Rental cost is invalid: {rental.rental_cost}.")
                 return Response({'error': 'Invalid rental cost'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Создает продукт и цену в Stripe
-            product = create_stripe_product(rental)
-            price = create_stripe_price(product, rental.rental_cost)
-
-            # Создает сессию оплаты
-            session = create_stripe_checkout_session(price.id, user_email)
+            # Повторный запрос возвращает уже созданный платёж
+            payment = Payment.objects.filter(
+                rental=rental, method='transfer', checkout_status__in=['pending', 'processing', 'created']
+            ).first()
+            if payment is not None:
+                return self.checkout_response(payment, status.HTTP_200_OK)
 
-            # Создает платеж в системе
+            # Создает платеж в системе, ссылка на оплату будет создана в фоне
             payment = Payment.objects.create(
                 user=request.user,
                 rental=rental,
                 amount=rental.rental_cost,
                 method='transfer',
-                session_id=session.id,
-                payment_link=session.url,
-                stripe_product_id=product.id
+                checkout_status='pending',
+                checkout_next_attempt_at=now(),
             )
+            transaction.on_commit(process_payment_outbox.delay)
+
+        logger.info(f"Payment {payment.pk} is queued for {rental.pk}.")
+        return self.checkout_response(payment, status.HTTP_202_ACCEPTED)
+
+    def checkout_response(self, payment, response_status):
+        data = PaymentCheckoutSerializer(payment).data
+        data['status_url'] = reverse('users:payment-checkout', kwargs={'pk': payment.pk}, request=self.request)
+        return Response(data, status=response_status)
 
-            # Логирование создания ссылки на оплату
-            logger.info(f"Payment link is created for {rental.pk}.")
 
-            # Возвращает ссылку на оплату
-            return Response({'payment_url': session.url}, status=status.HTTP_201_CREATED)
+class PaymentCheckoutView(generics.RetrieveAPIView):
+    """
+    Представление для получения ссылки на оплату.
 
-        except StripeError as e:
-            logging.error(f"An error occurred when creating a payment link: {str(e)}.")
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    Пока ссылка создаётся, возвращает статус 'pending' или 'processing' и заголовок Retry-After.
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = PaymentCheckoutSerializer
+
+    def get_queryset(self):
+        return Payment.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.data['checkout_status'] in ('pending', 'processing'):
+            response['Retry-After'] = '1'
+        return response
 
 
 class PaymentStatusView(APIView):
     """
-        Представление для обработки статуса платежа после успешной оплаты через Stripe.
-        Ожидает параметр 'session_id' в GET-запросе, использует его для получения информации о сессии оплаты из Stripe
-        и обновления статуса платежа в базе данных.
+        Представление для отображения статуса платежа после оплаты через Stripe.
+        Ожидает параметр 'session_id' в GET-запросе и возвращает статус платежа из базы данных.
+        Статус платежа обновляется вебхуком Stripe (StripeWebhookView), поэтому запрос к Stripe не выполняется.
         Переход на страницу статуса платежа переходит автоматически после успешной оплаты.
     """
 
@@ -169,39 +201,70 @@ class PaymentStatusView(APIView):
             logging.warning("Session ID is not provided.")
             return Response({'error': 'Session ID is required'}, status=400)
 
-        try:
-            # Получаем информацию о сессии оплаты из Stripe
-            session = retrieve_stripe_checkout_session(session_id)
-            payment_status = session.payment_status
+        # Находим платеж в базе данных по stripe_session_id
+        payment_status = get_object_or_404(Payment.objects.values_list('status', flat=True), session_id=session_id)
 
-            # Находим платеж в базе данных по stripe_session_id
-            payment = get_object_or_404(Payment, session_id=session_id)
+        if payment_status == 'paid':
+            return Response({'message': 'Payment is accepted', 'status': payment_status}, status=status.HTTP_200_OK)
 
-            if payment:
-                # Сохраняем статус платежа в базе данных
-                payment.status = payment_status
-                logging.info(f"Payment status from Stripe: {payment_status}.")
+        # Вебхук об оплате ещё не получен
+        response = Response({'message': 'Payment is being processed', 'status': payment_status},
+                            status=status.HTTP_202_ACCEPTED)
+        response['Retry-After'] = '1'
+        return response
 
-                # Обновляем статус аренды
-                if payment_status == 'paid':
-                    rental = payment.rental
-                    rental.status = 'completed'
-                    rental.save()  # Обновляем статус аренды
 
-                payment.save()
+class StripeWebhookView(APIView):
+    """
+    Вебхук Stripe для получения статусов оплаты.
 
-                # Логирование успешной оплаты
-                logger.info(f"Payment has been received for {session_id}.")
+    Проверяет подпись события, сохраняет его (повторно доставленные события отбрасываются
+    по id события) и сразу отвечает Stripe. События применяются к платежам и арендам
+    пакетами фоновой задачей process_stripe_events.
+    """
 
-            # Возвращаем подтверждение об оплате
-            return Response({'message': 'Payment is accepted'}, status=status.HTTP_202_ACCEPTED)
-        except StripeError as e:
-            # Возвращаем ошибку, если произошла ошибка при взаимодействии с Stripe API
-            logging.error(f"Stripe error occurred: {str(e)}.")
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    authentication_classes = []
+    permission_classes = [AllowAny]
 
+    HANDLED_EVENTS = (
+        'checkout.session.completed',
+        'checkout.session.async_payment_succeeded',
+        'checkout.session.async_payment_failed',
+    )
+
+    def post(self, request):
+        try:
+            event = construct_webhook_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE'))
+        except (StripeError, ValueError) as e:
+            logging.warning(f"Invalid Stripe webhook: {e}.")
+            return Response({'error': 'Invalid webhook signature'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if event['type'] not in self.HANDLED_EVENTS:
+            return Response({'received': True})
+
+        session = event['data']['object']
+        payment_status = session['payment_status']
+        if event['type'] == 'checkout.session.async_payment_failed':
+            payment_status = 'failed'
+
+        StripeEvent.objects.bulk_create(
+            [StripeEvent(
+                event_id=event['id'],
+                type=event['type'],
+                session_id=session['id'],
+                payment_status=payment_status,
+                created=datetime.fromtimestamp(event['created'], tz=timezone.utc),
+            )],
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(process_stripe_events.delay)
+        logger.info(f"Stripe event {event['id']} is received for {session['id']}.")
+        return Response({'received': True})
+
+
+class PaymentListView(ReplicaReadMixin, SparseFieldsMixin, generics.ListAPIView):
+    """API эндпоинт для просмотра истории платежей. Поддерживает выборочные поля (?fields=)."""
 
-class PaymentListView(generics.ListAPIView):
     serializer_class = PaymentSerializer
     filter_backends = [DjangoFilterBackend]  # Бэкенд для обработки фильтра
     filterset_class = PaymentFilterSet
@@ -210,7 +273,21 @@ class PaymentListView(generics.ListAPIView):
 
     def get_queryset(self):
         # Показывает только платежи пользователя
-        if not self.request.user.groups.filter(name='moderators').exists():
-            return Payment.objects.filter(user=self.request.user)
+        queryset = Payment.objects.select_related('rental__rented_bike')
+        if not is_moderator(self.request.user):
+            return queryset.filter(user=self.request.user)
         # Для модератора показывает все
-        return Payment.objects.all()
+        return queryset
+
+
+class PaymentExportView(ExportAPIView):
+    """API эндпоинт для потоковой выгрузки платежей в csv или ndjson с фильтрами истории платежей."""
+
+    permission_classes = (IsAuthenticated, IsModerator)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PaymentFilterSet
+    export_columns = PAYMENT_COLUMNS
+    export_name = "payments"
+
+    def get_queryset(self):
+        return payment_export_queryset()